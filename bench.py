@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+bench.py
+generate_content.py / build_html.py の計測用スクリプト。
+  parse DIR  --record で保存した生レスポンスを、モード（text / tool_use）ごとに
+             パース失敗率・スキーマ適合率・有効な1日分あたりの出力トークンで比較する。
+  load       mock_api.py を立ち上げ、同時実行数を変えながら生成パイプラインを流して
+             スループット・レイテンシの裾・リトライ数を比べる（APIクレジット不要）。
+  prompt DIR system プロンプトの版（full / compact）ごとに入力トークン数と、
+             記録済みレスポンスのスキーマ適合率を並べ、基準を満たす一番小さい版を示す。
+  render     content/*.json を水増しした合成コーパスで build_html.py の描画を
+             直列と --jobs N で流し、所要時間と速度比を比べる。
+Usage: python generate_content.py --all --record fixtures/text
+       python generate_content.py --all --tool-use --record fixtures/tool
+       python bench.py parse fixtures/text fixtures/tool
+       python bench.py load --concurrency 1,4,8,16 --mock "--latency 1 --latency-dist lognormal --error-rate 0.05"
+       python generate_content.py --all --prompt compact --record fixtures/compact
+       python bench.py prompt fixtures/text fixtures/compact --count-tokens
+       python bench.py render --pages 1000 --jobs 1,2,4,8
+"""
+
+import io
+import os
+import json
+import sys
+import time
+import shlex
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from pathlib import Path
+
+import build_html
+import generate_content
+from generate_content import (
+    DAY_KEYS, format_seconds, parse_response_text, percentile, repair_truncated_json, schema_errors,
+    tool_schema, validate_day,
+)
+
+# 1日分を構成するセクション（day / sweet はプロンプトで決まるので数えない）
+SECTION_KEYS = [key for key in DAY_KEYS if key not in ("day", "sweet")]
+
+
+def load_fixtures(dirs: list) -> list:
+    """フィクスチャ（*.json）をすべて読み込む。"""
+    fixtures = []
+    for directory in dirs:
+        for path in sorted(Path(directory).glob("*.json")):
+            with open(path, "r", encoding="utf-8") as f:
+                fixtures.append(json.load(f))
+    return fixtures
+
+
+def check_fixture(fixture: dict) -> dict:
+    """1件をパース・検証する。{"status", "parse_s", "days"} を返す。
+
+    status は aborted / parse_error / repaired_invalid / invalid / repaired / ok。
+    days はそのレスポンスが1日分の何割にあたるか（セクション単位の生成なら一部）。
+    """
+    keys = fixture["keys"]
+    days = sum(key in keys for key in SECTION_KEYS) / len(SECTION_KEYS)
+    if fixture.get("aborted"):
+        return {"status": "aborted", "parse_s": 0.0, "days": days}
+    text = fixture["text"]
+    repaired = False
+    started = time.perf_counter()
+    try:
+        data = parse_response_text(text)
+    except json.JSONDecodeError:
+        data = None
+        if fixture.get("stop_reason") == "max_tokens":
+            try:
+                data = parse_response_text(repair_truncated_json(text))
+                repaired = True
+            except json.JSONDecodeError:
+                pass
+    parse_s = time.perf_counter() - started
+    if data is None:
+        return {"status": "parse_error", "parse_s": parse_s, "days": days}
+    if keys == DAY_KEYS:
+        errors = validate_day(data)
+    else:
+        errors = schema_errors(data, tool_schema(keys))
+    status = ("repaired_" if repaired else "") + ("invalid" if errors else "ok")
+    return {"status": status, "parse_s": parse_s, "days": days}
+
+
+def output_tokens(fixtures: list) -> int:
+    """出力トークンの合計。打ち切った試行は usage が無いので、同じモードの文字数比で見積もる。"""
+    known = [f for f in fixtures if f.get("usage", {}).get("output_tokens")]
+    total = sum(f["usage"]["output_tokens"] for f in known)
+    chars = sum(len(f["text"]) for f in known)
+    ratio = total / chars if chars else 1 / 3
+    aborted = sum(len(f["text"]) for f in fixtures if f.get("aborted"))
+    return total + round(aborted * ratio)
+
+
+def run_parse(dirs: list):
+    fixtures = load_fixtures(dirs)
+    if not fixtures:
+        print(f"No fixtures in {', '.join(map(str, dirs))}")
+        sys.exit(1)
+    modes = {}
+    for fixture in fixtures:
+        modes.setdefault(fixture["mode"], []).append(fixture)
+
+    print(f"  {'mode':<9} {'resp':>5} {'aborted':>7} {'parse_err':>9} {'invalid':>7} {'repaired':>8} "
+          f"{'valid%':>7} {'parse_ms':>8} {'out_tok':>9} {'tok/valid_day':>13}")
+    for mode, rows in sorted(modes.items()):
+        results = [check_fixture(fixture) for fixture in rows]
+        count = lambda *names: sum(r["status"] in names for r in results)
+        valid = [r for r in results if r["status"] in ("ok", "repaired_ok")]
+        valid_days = sum(r["days"] for r in valid)
+        parsed = [r["parse_s"] for r in results if r["status"] not in ("aborted", "parse_error")]
+        tokens = output_tokens(rows)
+        per_day = f"{tokens / valid_days:>13.0f}" if valid_days else f"{'-':>13}"
+        print(f"  {mode:<9} {len(rows):>5} {count('aborted'):>7} {count('parse_error'):>9} "
+              f"{count('invalid', 'repaired_invalid'):>7} {count('repaired_ok', 'repaired_invalid'):>8} "
+              f"{len(valid) / len(rows):>7.1%} "
+              f"{1000 * sum(parsed) / max(len(parsed), 1):>8.2f} {tokens:>9} {per_day}")
+
+
+@contextlib.contextmanager
+def mock_server(mock_args: str):
+    """mock_api.py を空いているポートで起動し、base URL を返す。抜けると止める。
+
+    計測する側と GIL を取り合わないよう別プロセスで動かす。
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).parent / "mock_api.py"), "--port", str(port), *shlex.split(mock_args)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"mock_api.py did not start (args: {mock_args!r})")
+                time.sleep(0.05)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_level(base_url: str, days: list, concurrency: int, opts: dict, rpm: float, tpm: float,
+              keys: int = 1) -> dict:
+    """同時実行数 concurrency で1回流し、集計結果を返す。
+
+    出力・キャッシュ・マニフェスト・メトリクスは一時ディレクトリに向けるので、
+    リポジトリの content/ や .state/ には触らない。キャッシュは毎回空から始まる。
+    keys 本のダミーキーでキープールを作る（mock の --rpm はキーごとの上限になる）。
+    """
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        tmp = Path(tmp)
+        generate_content.CACHE_DIR = tmp / "cache"
+        generate_content.RUN_MANIFEST = tmp / "manifest.json"
+        generate_content.METRICS_FILE = tmp / "metrics.jsonl"
+        generate_content.RUN_ID = f"bench-c{concurrency}"
+        slots = [generate_content.KeySlot(
+                     f"key{i}", generate_content.anthropic.AsyncAnthropic(
+                         base_url=base_url, api_key=f"bench-key-{i}", max_retries=0), rpm, tpm)
+                 for i in range(1, keys + 1)]
+        scheduler = generate_content.RequestScheduler(slots=slots)
+        (tmp / "out").mkdir()
+        started = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(generate_content.run_days(scheduler, days, tmp / "out", concurrency, opts))
+        elapsed = time.monotonic() - started
+
+        manifest = generate_content.load_state(generate_content.RUN_MANIFEST).get("days", {})
+        records = []
+        if generate_content.METRICS_FILE.exists():
+            with open(generate_content.METRICS_FILE, "r", encoding="utf-8") as f:
+                records = [json.loads(line) for line in f if line.strip()]
+
+    done = [entry for entry in manifest.values() if entry.get("status") == "done"]
+    day_seconds = [entry["duration_s"] for entry in done if entry.get("duration_s") is not None]
+    latency = [r["latency_s"] for r in records if r.get("latency_s") is not None]
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "done": len(done),
+        "errors": len(manifest) - len(done),
+        "days_per_min": 60 * len(done) / elapsed if elapsed else 0.0,
+        "requests": len(records),
+        "day_p50": percentile(day_seconds, 50),
+        "day_p95": percentile(day_seconds, 95),
+        "day_p99": percentile(day_seconds, 99),
+        "req_p50": percentile(latency, 50),
+        "req_p95": percentile(latency, 95),
+        "req_p99": percentile(latency, 99),
+        "retries": sum(r.get("retries", 0) for r in records),
+        "aborts": sum(r.get("aborts", 0) for r in records),
+    }
+
+
+def run_load(args):
+    levels = [int(level) for level in args.concurrency.split(",")]
+    start, end = map(int, args.range.split("-"))
+    days = list(range(start, end + 1))
+    opts = {**generate_content.DEFAULT_OPTS, "force": True, "split": args.split, "tool_use": args.tool_use}
+    print(f"Load test: Day {start}-{end}, {args.keys} key(s), mock {args.mock!r}")
+    print(f"  {'conc':>4} {'done':>4} {'err':>3} {'wall':>8} {'days/min':>8} {'reqs':>5} "
+          f"{'day p50':>8} {'day p95':>8} {'day p99':>8} {'req p50':>8} {'req p95':>8} {'req p99':>8} "
+          f"{'retries':>7} {'aborts':>6}")
+    for level in levels:
+        # レベルごとに mock を立て直して、レート制限のカウンタや prompt cache を持ち越さない
+        with mock_server(args.mock) as base_url:
+            result = run_level(base_url, days, level, opts, args.rpm, args.tpm, args.keys)
+        print(f"  {level:>4} {result['done']:>4} {result['errors']:>3} {format_seconds(result['elapsed_s']):>8} "
+              f"{result['days_per_min']:>8.1f} {result['requests']:>5} "
+              + " ".join(f"{format_seconds(result[name]):>8}" for name in
+                         ("day_p50", "day_p95", "day_p99", "req_p50", "req_p95", "req_p99"))
+              + f" {result['retries']:>7} {result['aborts']:>6}", flush=True)
+
+
+def prompt_tokens(name: str, count: bool) -> tuple:
+    """Day 1 を丸ごと頼むときの入力トークン数。(tokens, 実測か) を返す。
+
+    count=True なら count_tokens API で数える（ANTHROPIC_BASE_URL で mock にも向けられる）。
+    """
+    params = generate_content.request_params(1, generate_content.MENU[1], {**generate_content.DEFAULT_OPTS,
+                                                                            "prompt": name})
+    if count:
+        client = generate_content.anthropic.Anthropic()
+        result = client.messages.count_tokens(model=params["model"], system=params["system"],
+                                              messages=params["messages"])
+        return result.input_tokens, True
+    return generate_content.estimate_tokens(params) - params["max_tokens"] // 2, False
+
+
+def run_prompt(dirs: list, min_valid: float, count: bool):
+    fixtures = load_fixtures(dirs)
+    variants = {name: [] for name in generate_content.PROMPTS}
+    for fixture in fixtures:
+        variants.setdefault(fixture.get("prompt", "full"), []).append(fixture)
+
+    print(f"  {'prompt':<8} {'chars':>6} {'tokens':>7} {'resp':>5} {'valid%':>7} {'in/resp':>8}")
+    candidates = []
+    for name, rows in variants.items():
+        text = generate_content.PROMPTS.get(name, "")
+        tokens, exact = prompt_tokens(name, count) if text else (None, False)
+        results = [check_fixture(fixture) for fixture in rows]
+        valid = sum(r["status"] in ("ok", "repaired_ok") for r in results)
+        rate = valid / len(rows) if rows else None
+        # 実際に払った入力（キャッシュ分を含む）。打ち切った試行は usage が無いので除く
+        used = [f["usage"] for f in rows if f.get("usage")]
+        inputs = [u.get("input_tokens", 0) + u.get("cache_creation_input_tokens", 0)
+                  + u.get("cache_read_input_tokens", 0) for u in used]
+        tokens_col = "-" if tokens is None else f"{tokens}" if exact else f"~{tokens}"
+        print(f"  {name:<8} {len(text):>6} {tokens_col:>7} {len(rows):>5} "
+              f"{'-' if rate is None else f'{rate:.1%}':>7} "
+              f"{'-' if not inputs else sum(inputs) // len(inputs):>8}")
+        if rate is not None and rate >= min_valid and tokens is not None:
+            candidates.append((tokens, name))
+    if not fixtures:
+        print("\n  No fixtures: record some with generate_content.py --prompt NAME --record DIR")
+    elif candidates:
+        print(f"\n  Smallest prompt with validity ≥ {min_valid:.0%}: {min(candidates)[1]}")
+    else:
+        print(f"\n  No prompt reached validity ≥ {min_valid:.0%}")
+
+
+def make_corpus(content_dir: Path, pages: int) -> list:
+    """content/*.json を日番号を振り直しながら繰り返し書き、pages 日分の合成コーパスを作る。"""
+    sources = sorted(build_html.CONTENT_DIR.glob("day*.json"), key=lambda p: int(p.stem[3:]))
+    if not sources:
+        sys.exit("No content/day*.json to build a corpus from")
+    for day in range(1, pages + 1):
+        data = json.loads(sources[(day - 1) % len(sources)].read_text(encoding="utf-8"))
+        data["day"] = day
+        (content_dir / f"day{day}.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return list(range(1, pages + 1))
+
+
+def run_render(pages: int, levels: list):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        content_dir = tmp / "content"
+        content_dir.mkdir()
+        days = make_corpus(content_dir, pages)
+        code = build_html.renderer_fingerprint()
+        print(f"Render benchmark: {pages} page(s), {os.cpu_count()} CPU(s)")
+        print(f"  {'jobs':>4} {'wall':>8} {'pages/s':>8} {'speedup':>7} {'same':>5}")
+        baseline = reference = None
+        for jobs in levels:
+            # レベルごとに空の出力先と空の manifest から始めて、全ページを実際に描画させる
+            docs_dir = tmp / f"docs-{jobs}"
+            docs_dir.mkdir()
+            started = time.perf_counter()
+            build_html.build_days(days, {"days": {}}, code, jobs=jobs, content_dir=content_dir,
+                                  docs_dir=docs_dir, quiet=True)
+            elapsed = time.perf_counter() - started
+            output = {p.name: p.read_bytes() for p in docs_dir.iterdir()}
+            baseline = baseline or elapsed
+            reference = reference or output
+            print(f"  {jobs:>4} {format_seconds(elapsed):>8} {pages / elapsed:>8.1f} "
+                  f"{baseline / elapsed:>6.2f}x {'yes' if output == reference else 'NO':>5}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate_content.py の計測")
+    commands = parser.add_subparsers(dest="command", required=True)
+    parse = commands.add_parser("parse", help="記録済みレスポンスのパース失敗率・有効トークンを比較")
+    parse.add_argument("dirs", type=Path, nargs="+", help="--record で保存したディレクトリ")
+    load = commands.add_parser("load", help="mock_api.py 相手に同時実行数ごとの負荷試験")
+    load.add_argument("--concurrency", default="1,4,8,16",
+                      help="試す同時実行数（カンマ区切り、デフォルト: 1,4,8,16）")
+    load.add_argument("--range", default="1-30", help="生成する日の範囲 (デフォルト: 1-30)")
+    load.add_argument("--mock", default="--latency 0.5 --latency-dist lognormal --tokens-per-sec 400",
+                      help="mock_api.py に渡す引数（遅延分布・エラー率・ストリーミング速度など）")
+    load.add_argument("--split", action="store_true", help="generate_content.py --split と同じ分割生成で流す")
+    load.add_argument("--tool-use", action="store_true", help="generate_content.py --tool-use と同じモードで流す")
+    load.add_argument("--rpm", type=float, default=generate_content.DEFAULT_RPM,
+                      help=f"スケジューラの RPM 初期値 (デフォルト: {generate_content.DEFAULT_RPM})")
+    load.add_argument("--tpm", type=float, default=generate_content.DEFAULT_TPM,
+                      help=f"スケジューラの TPM 初期値 (デフォルト: {generate_content.DEFAULT_TPM})")
+    load.add_argument("--keys", type=int, default=1,
+                      help="キープールのキー数（mock の --rpm はキーごとに効く、デフォルト: 1）")
+    prompt = commands.add_parser("prompt", help="プロンプトの版ごとのトークン数とスキーマ適合率")
+    prompt.add_argument("dirs", type=Path, nargs="*", help="--record で保存したディレクトリ")
+    prompt.add_argument("--min-valid", type=float, default=0.95,
+                        help="採用できる適合率の下限 (デフォルト: 0.95)")
+    prompt.add_argument("--count-tokens", action="store_true",
+                        help="count_tokens API で正確に数える（APIキーが必要。無ければ文字数からの見積もり）")
+    render = commands.add_parser("render", help="build_html.py の直列・並列描画の速度比較")
+    render.add_argument("--pages", type=int, default=1000, help="合成コーパスのページ数 (デフォルト: 1000)")
+    render.add_argument("--jobs", default="1,2,4,8",
+                        help="試すプロセス数（カンマ区切り、先頭が基準、デフォルト: 1,2,4,8）")
+    args = parser.parse_args()
+
+    if args.command == "parse":
+        run_parse(args.dirs)
+    elif args.command == "load":
+        run_load(args)
+    elif args.command == "prompt":
+        run_prompt(args.dirs, args.min_valid, args.count_tokens)
+    elif args.command == "render":
+        run_render(args.pages, [int(jobs) for jobs in args.jobs.split(",")])
+
+
+if __name__ == "__main__":
+    main()
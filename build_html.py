@@ -7,14 +7,40 @@ Usage: python build_html.py [--day N] [--all]
 
 import json
 import os
+import re
 import sys
+import time
+import hashlib
+import gzip
+import base64
 import argparse
+import functools
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from html import escape as h
 
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    # Pillow が無ければアバターの縮小版は作らず、元画像をそのまま参照する
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    # brotli が無ければ .br は作らず .gz だけにする
+    brotli = None
+
 BASE_DIR = Path(__file__).parent
 CONTENT_DIR = BASE_DIR / "content"
 DOCS_DIR = BASE_DIR / "docs"
+BUILD_MANIFEST = BASE_DIR / ".state" / "build.json"
+AVATAR_SRC = BASE_DIR / "assets" / "ryosuke.jpg"
+AVATAR_STATE = BASE_DIR / ".state" / "avatar.json"
+AVATAR_SIZE = 36                # 表示サイズ (CSS px)
+AVATAR_SCALES = (1, 2, 3)       # 1x / 2x / 3x の縮小版を作る
+COMPRESS_SUFFIXES = (".html", ".css", ".js", ".json")
 TOTAL_DAYS = 30
 TOTAL_SECTIONS = 11
 
@@ -40,8 +66,25 @@ MENU = {
 
 
 def yamada_avatar_html():
-    """山田涼介のアバターHTML（実画像版）"""
-    return '<img src="assets/ryosuke.jpg" alt="Ryosuke" style="width:36px;height:36px;border-radius:50%;object-fit:cover;flex-shrink:0;box-shadow:0 2px 8px rgba(194,24,91,0.3);">'
+    """山田涼介のアバターHTML（実画像版）
+
+    process_avatar() で縮小版ができていれば srcset（WebP があれば <picture>）で参照し、
+    読み込むまでは小さなぼかし画像を背景に出す。できていなければ元画像を直接使う。
+    """
+    style = "width:36px;height:36px;border-radius:50%;object-fit:cover;flex-shrink:0;box-shadow:0 2px 8px rgba(194,24,91,0.3);"
+    info = avatar_info()
+    if not info:
+        return f'<img src="assets/ryosuke.jpg" alt="Ryosuke" style="{style}">'
+
+    def srcset(files):
+        return ", ".join(f"{f} {scale}x" for f, scale in zip(files, AVATAR_SCALES))
+
+    img = (f'<img src="{info["jpeg"][0]}" srcset="{srcset(info["jpeg"])}" width="{AVATAR_SIZE}" height="{AVATAR_SIZE}" '
+           f'alt="Ryosuke" loading="lazy" decoding="async" '
+           f'style="{style}background:url({info["placeholder"]}) center/cover;">')
+    if not info["webp"]:
+        return img
+    return f'<picture class="yamada-avatar"><source type="image/webp" srcset="{srcset(info["webp"])}">{img}</picture>'
 
 
 def yamada_comment_html(comment_text: str) -> str:
@@ -99,7 +142,6 @@ def section_recipe(data: dict) -> str:
     steps_html = ""
     for step in r["steps"]:
         # Convert **word** to <strong>word</strong>
-        import re
         step_formatted = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', step)
         steps_html += f"        <li>{step_formatted}</li>\n"
 
@@ -208,7 +250,6 @@ def section_tips(data: dict) -> str:
     tips = ""
     for tip in data["australia_tips"]:
         # Convert **text** to <strong>text</strong>
-        import re
         tip_formatted = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', tip)
         tips += f"      <p>{tip_formatted}</p>\n"
 
@@ -634,6 +675,7 @@ body {
   margin-bottom: 1rem; display: flex; gap: 0.6rem;
   align-items: flex-start; font-size: 0.85rem; line-height: 1.6;
 }
+.yamada-avatar { flex-shrink: 0; line-height: 0; }
 .yamada-text { flex: 1; }
 .yamada-name {
   font-size: 0.7rem; font-weight: 700; color: var(--yamada-accent);
@@ -1028,53 +1070,52 @@ body {
 }"""
 
 
-def build_js(day: int, sweet: str) -> str:
-    """JavaScriptコード（day1-v3.htmlベース）"""
-    return f'''let currentSpeed = 0.85;
-let repeatCounts = {{}};
+# 全ページ共通のJavaScript（day1-v3.htmlベース）。日ごとに変わる値は <body data-day data-sweet> から読む
+APP_JS = '''let currentSpeed = 0.85;
+let repeatCounts = {};
 
-function toggleSection(header) {{
+function toggleSection(header) {
   const card = header.parentElement;
   card.classList.toggle('open');
   const index = parseInt(card.dataset.index);
   const dots = document.querySelectorAll('.progress-dot');
-  if (card.classList.contains('open')) {{
+  if (card.classList.contains('open')) {
     dots[index].classList.add('active');
-    for (let i = 0; i < index; i++) {{ dots[i].classList.add('complete'); dots[i].classList.remove('active'); }}
-  }}
+    for (let i = 0; i < index; i++) { dots[i].classList.add('complete'); dots[i].classList.remove('active'); }
+  }
   const openCards = document.querySelectorAll('.section-card.open');
-  document.querySelector('.progress-label').textContent = openCards.length + ' / {TOTAL_SECTIONS} セクション';
-}}
+  document.querySelector('.progress-label').textContent = openCards.length + ' / ' + dots.length + ' セクション';
+}
 
-function toggleVocab(btn) {{
+function toggleVocab(btn) {
   const list = btn.nextElementSibling;
   list.classList.toggle('show');
   btn.textContent = list.classList.contains('show') ? '📚 単語リストを隠す' : '📚 単語リストを見る';
-}}
+}
 
-function checkQuiz(option, isCorrect) {{
+function checkQuiz(option, isCorrect) {
   const parent = option.parentElement;
   if (parent.dataset.answered) return;
   parent.dataset.answered = 'true';
   const allOptions = parent.querySelectorAll('.quiz-option');
   allOptions.forEach(opt => opt.style.pointerEvents = 'none');
-  if (isCorrect) {{
+  if (isCorrect) {
     option.classList.add('correct');
     parent.nextElementSibling.classList.add('show');
-  }} else {{
+  } else {
     option.classList.add('wrong');
     parent.nextElementSibling.nextElementSibling.classList.add('show');
-  }}
-}}
+  }
+}
 
 // Web Speech API TTS
-function speakText(elementId, btn) {{
-  if (window.speechSynthesis.speaking) {{
+function speakText(elementId, btn) {
+  if (window.speechSynthesis.speaking) {
     window.speechSynthesis.cancel();
     btn.textContent = '🔊 再生';
     btn.classList.remove('playing');
     return;
-  }}
+  }
   const text = document.getElementById(elementId).textContent;
   const utterance = new SpeechSynthesisUtterance(text);
   utterance.lang = 'en-AU';
@@ -1095,76 +1136,76 @@ function speakText(elementId, btn) {{
   const repeatEl = btn.parentElement.querySelector('.repeat-count');
   if (repeatEl) repeatEl.textContent = '再生回数: ' + repeatCounts[elementId];
 
-  utterance.onend = () => {{ btn.textContent = '🔊 再生'; btn.classList.remove('playing'); }};
-  utterance.onerror = () => {{ btn.textContent = '🔊 再生'; btn.classList.remove('playing'); }};
+  utterance.onend = () => { btn.textContent = '🔊 再生'; btn.classList.remove('playing'); };
+  utterance.onerror = () => { btn.textContent = '🔊 再生'; btn.classList.remove('playing'); };
   window.speechSynthesis.speak(utterance);
-}}
+}
 
 window.speechSynthesis.onvoiceschanged = () => window.speechSynthesis.getVoices();
 
-function checkAllGaps(btn) {{
+function checkAllGaps(btn) {
   const box = btn.closest('.listening-box');
   const inputs = box.querySelectorAll('input[data-answer]');
-  inputs.forEach(input => {{
+  inputs.forEach(input => {
     const correct = input.dataset.answer.toLowerCase();
     const val = input.value.trim().toLowerCase();
     input.classList.remove('correct-input', 'wrong-input');
-    if (val === correct) {{ input.classList.add('correct-input'); }}
-    else {{ input.classList.add('wrong-input'); }}
-  }});
+    if (val === correct) { input.classList.add('correct-input'); }
+    else { input.classList.add('wrong-input'); }
+  });
   const answer = box.querySelector('.listening-answer');
   if (answer) answer.classList.add('show');
-}}
+}
 
-function toggleScript(btn) {{
+function toggleScript(btn) {
   const script = btn.nextElementSibling;
   script.classList.toggle('show');
   btn.textContent = script.classList.contains('show') ? '📝 スクリプトを隠す' : '📝 スクリプトを見る';
-}}
+}
 
-function copyText(id) {{
+function copyText(id) {
   const text = document.getElementById(id).textContent;
   navigator.clipboard.writeText(text).then(() => alert('コピーしました！'));
-}}
+}
 
-function generateSummary() {{
+function generateSummary() {
   const checked = document.querySelectorAll('.vocab-item.checked');
   const vocabList = Array.from(checked).map(i => i.querySelector('.vocab-en').textContent);
   const tryIt = document.getElementById('tryit-text').value;
   const listeningPlays = Object.entries(repeatCounts).map(([k,v]) => k + ': ' + v + '回').join(', ');
 
-  let s = `【Day {day}: {sweet} 学習サマリー】\\n\\n`;
-  s += `■ チェックした単語 (${{vocabList.length}}個):\\n${{vocabList.length > 0 ? vocabList.join(', ') : 'なし'}}\\n\\n`;
-  s += `■ リスニング再生回数:\\n${{listeningPlays || '未再生'}}\\n\\n`;
+  let s = `【Day ${document.body.dataset.day}: ${document.body.dataset.sweet} 学習サマリー】\\n\\n`;
+  s += `■ チェックした単語 (${vocabList.length}個):\\n${vocabList.length > 0 ? vocabList.join(', ') : 'なし'}\\n\\n`;
+  s += `■ リスニング再生回数:\\n${listeningPlays || '未再生'}\\n\\n`;
 
   const pronunSummary = pronunResults.filter(r => r).map((r, i) =>
-    `  ${{i+1}}. "${{r.target}}" → ${{r.score}}% (認識: "${{r.heard}}")`
+    `  ${i+1}. "${r.target}" → ${r.score}% (認識: "${r.heard}")`
   ).join('\\n');
-  s += `■ 発音チェック結果:\\n${{pronunSummary || '(未実施)'}}\\n\\n`;
+  s += `■ 発音チェック結果:\\n${pronunSummary || '(未実施)'}\\n\\n`;
 
-  s += `■ Today's Writing:\\n${{tryIt || '(未記入)'}}\\n\\n`;
+  s += `■ Today's Writing:\\n${tryIt || '(未記入)'}\\n\\n`;
   s += `---\\n上の内容をもとに、以下を教えてください：\\n1. チェックした単語の使い方（例文付き）\\n2. 発音チェックで間違えた部分のアドバイス\\n3. Today's Writingの添削\\n4. 今日学んだフレーズの発展表現`;
 
   const output = document.getElementById('summary-output');
   output.textContent = s;
   output.classList.add('show');
-}}
+}
 
-function copySummary() {{
+function copySummary() {
   const text = document.getElementById('summary-output').textContent;
   navigator.clipboard.writeText(text).then(() => alert('コピーしました！'));
-}}
+}
 
-document.querySelectorAll('.progress-dot').forEach(dot => {{
-  dot.addEventListener('click', () => {{
+document.querySelectorAll('.progress-dot').forEach(dot => {
+  dot.addEventListener('click', () => {
     const index = parseInt(dot.dataset.section);
     const cards = document.querySelectorAll('.section-card');
-    if (cards[index]) {{
-      cards[index].scrollIntoView({{ behavior: 'smooth', block: 'start' }});
+    if (cards[index]) {
+      cards[index].scrollIntoView({ behavior: 'smooth', block: 'start' });
       if (!cards[index].classList.contains('open')) toggleSection(cards[index].querySelector('.section-header'));
-    }}
-  }});
-}});
+    }
+  });
+});
 
 // ===== PRONUNCIATION CHECK =====
 // pronunSentences is defined in the HTML before this script
@@ -1174,41 +1215,41 @@ let pronunResults = [];
 let pronunRecognition = null;
 let isRecording = false;
 
-function initPronun() {{
+function initPronun() {
   renderPronunSentence();
   updatePronunNav();
-}}
+}
 
-function renderPronunSentence() {{
+function renderPronunSentence() {
   const target = document.getElementById('pronun-target');
   const sentence = pronunSentences[currentPronunIndex];
   const words = sentence.text.split(' ');
-  target.innerHTML = words.map((w, i) => `<span class="word" data-index="${{i}}">${{w}}</span>`).join(' ');
+  target.innerHTML = words.map((w, i) => `<span class="word" data-index="${i}">${w}</span>`).join(' ');
 
   const result = document.getElementById('pronun-result');
   result.classList.remove('show', 'good', 'needs-work', 'try-again');
-}}
+}
 
-function updatePronunNav() {{
+function updatePronunNav() {
   document.getElementById('pronun-counter').textContent =
-    `${{currentPronunIndex + 1}} / ${{pronunSentences.length}}`;
+    `${currentPronunIndex + 1} / ${pronunSentences.length}`;
   document.getElementById('pronun-prev').classList.toggle('disabled', currentPronunIndex === 0);
   document.getElementById('pronun-next').classList.toggle('disabled', currentPronunIndex === pronunSentences.length - 1);
-}}
+}
 
-function changePronunSentence(dir) {{
+function changePronunSentence(dir) {
   const newIndex = currentPronunIndex + dir;
   if (newIndex < 0 || newIndex >= pronunSentences.length) return;
   currentPronunIndex = newIndex;
   renderPronunSentence();
   updatePronunNav();
-}}
+}
 
-function speakPronunSentence() {{
-  if (window.speechSynthesis.speaking) {{
+function speakPronunSentence() {
+  if (window.speechSynthesis.speaking) {
     window.speechSynthesis.cancel();
     return;
-  }}
+  }
   const text = pronunSentences[currentPronunIndex].text;
   const utterance = new SpeechSynthesisUtterance(text);
   utterance.lang = 'en-AU';
@@ -1219,18 +1260,18 @@ function speakPronunSentence() {{
                   voices.find(v => v.lang.startsWith('en'));
   if (enVoice) utterance.voice = enVoice;
   window.speechSynthesis.speak(utterance);
-}}
+}
 
-function togglePronunRecording() {{
-  if (!('webkitSpeechRecognition' in window) && !('SpeechRecognition' in window)) {{
+function togglePronunRecording() {
+  if (!('webkitSpeechRecognition' in window) && !('SpeechRecognition' in window)) {
     alert('お使いのブラウザは音声認識に対応していません。Chrome をお使いください。');
     return;
-  }}
+  }
 
-  if (isRecording) {{
+  if (isRecording) {
     stopPronunRecording();
     return;
-  }}
+  }
 
   const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
   pronunRecognition = new SpeechRecognition();
@@ -1244,54 +1285,54 @@ function togglePronunRecording() {{
   btn.classList.add('recording');
   isRecording = true;
 
-  pronunRecognition.onresult = (event) => {{
+  pronunRecognition.onresult = (event) => {
     const results = event.results[0];
     const heard = results[0].transcript;
     const confidence = results[0].confidence;
     const alternatives = [];
-    for (let i = 0; i < results.length; i++) {{
+    for (let i = 0; i < results.length; i++) {
       alternatives.push(results[i].transcript.toLowerCase());
-    }}
+    }
     evaluatePronunciation(heard, confidence, alternatives);
     stopPronunRecording();
-  }};
+  };
 
-  pronunRecognition.onerror = (event) => {{
+  pronunRecognition.onerror = (event) => {
     stopPronunRecording();
-    if (event.error === 'no-speech') {{
+    if (event.error === 'no-speech') {
       alert('音声が検出されませんでした。もう少し大きな声ではっきり話してみてください。');
-    }} else if (event.error === 'not-allowed') {{
+    } else if (event.error === 'not-allowed') {
       alert('マイクの使用が許可されていません。ブラウザの設定でマイクを許可してください。');
-    }} else {{
+    } else {
       alert('音声認識エラー: ' + event.error);
-    }}
-  }};
+    }
+  };
 
-  pronunRecognition.onend = () => {{
+  pronunRecognition.onend = () => {
     stopPronunRecording();
-  }};
+  };
 
   pronunRecognition.start();
-}}
+}
 
-function stopPronunRecording() {{
+function stopPronunRecording() {
   const btn = document.getElementById('pronun-btn');
   btn.textContent = '🎤 もう一回';
   btn.classList.remove('recording');
   isRecording = false;
-  if (pronunRecognition) {{
-    try {{ pronunRecognition.stop(); }} catch(e) {{}}
-  }}
-}}
+  if (pronunRecognition) {
+    try { pronunRecognition.stop(); } catch(e) {}
+  }
+}
 
-function normalizeText(text) {{
+function normalizeText(text) {
   return text.toLowerCase()
     .replace(/[.,!?;:'"()\\-]/g, '')
     .replace(/\\s+/g, ' ')
     .trim();
-}}
+}
 
-function evaluatePronunciation(heard, confidence, alternatives) {{
+function evaluatePronunciation(heard, confidence, alternatives) {
   const target = pronunSentences[currentPronunIndex].text;
   const tip = pronunSentences[currentPronunIndex].tip;
 
@@ -1299,14 +1340,14 @@ function evaluatePronunciation(heard, confidence, alternatives) {{
   const heardWords = normalizeText(heard).split(' ');
 
   const allHeardWords = new Set();
-  alternatives.forEach(alt => {{
+  alternatives.forEach(alt => {
     normalizeText(alt).split(' ').forEach(w => allHeardWords.add(w));
-  }});
+  });
 
   let correctCount = 0;
   const wordElements = document.querySelectorAll('#pronun-target .word');
 
-  targetWords.forEach((targetWord, i) => {{
+  targetWords.forEach((targetWord, i) => {
     const el = wordElements[i];
     if (!el) return;
 
@@ -1314,24 +1355,24 @@ function evaluatePronunciation(heard, confidence, alternatives) {{
 
     const targetClean = targetWord.toLowerCase();
 
-    if (heardWords.includes(targetClean) || allHeardWords.has(targetClean)) {{
+    if (heardWords.includes(targetClean) || allHeardWords.has(targetClean)) {
       el.classList.add('correct');
       correctCount++;
-    }} else {{
+    } else {
       const similar = heardWords.some(hw => levenshtein(hw, targetClean) <= 1) ||
                       [...allHeardWords].some(hw => levenshtein(hw, targetClean) <= 1);
-      if (similar) {{
+      if (similar) {
         el.classList.add('correct');
         correctCount++;
-      }} else {{
+      } else {
         el.classList.add('wrong');
-      }}
-    }}
-  }});
+      }
+    }
+  });
 
   const score = Math.round((correctCount / targetWords.length) * 100);
 
-  pronunResults[currentPronunIndex] = {{ score, heard, target }};
+  pronunResults[currentPronunIndex] = { score, heard, target };
 
   const resultEl = document.getElementById('pronun-result');
   const scoreCircle = document.getElementById('pronun-score-circle');
@@ -1344,67 +1385,67 @@ function evaluatePronunciation(heard, confidence, alternatives) {{
   scoreCircle.classList.remove('high', 'mid', 'low');
   resultEl.classList.remove('good', 'needs-work', 'try-again');
 
-  if (score >= 80) {{
+  if (score >= 80) {
     scoreCircle.classList.add('high');
     scoreLabel.textContent = '🎉 Great!';
     scoreDetail.textContent = 'しっかり通じる発音です！';
     resultEl.classList.add('good');
-  }} else if (score >= 50) {{
+  } else if (score >= 50) {
     scoreCircle.classList.add('mid');
     scoreLabel.textContent = '👍 Almost!';
     scoreDetail.textContent = 'もう少し！赤い単語を意識してみよう。';
     resultEl.classList.add('needs-work');
-  }} else {{
+  } else {
     scoreCircle.classList.add('low');
     scoreLabel.textContent = '💪 Keep trying!';
     scoreDetail.textContent = 'お手本を聴いてからもう一回チャレンジ！';
     resultEl.classList.add('try-again');
-  }}
+  }
 
-  heardEl.innerHTML = `<strong>🎧 認識された音声:</strong> "${{heard}}"`;
-  tipsEl.innerHTML = `<li>💡 ${{tip}}</li>`;
+  heardEl.innerHTML = `<strong>🎧 認識された音声:</strong> "${heard}"`;
+  tipsEl.innerHTML = `<li>💡 ${tip}</li>`;
 
   const wrongWords = [];
-  wordElements.forEach((el, i) => {{
-    if (el.classList.contains('wrong') && targetWords[i]) {{
+  wordElements.forEach((el, i) => {
+    if (el.classList.contains('wrong') && targetWords[i]) {
       wrongWords.push(targetWords[i]);
-    }}
-  }});
-  if (wrongWords.length > 0) {{
-    tipsEl.innerHTML += `<li>🔴 認識されなかった単語: <strong>${{wrongWords.join(', ')}}</strong> — ゆっくりはっきり発音してみよう</li>`;
-  }}
+    }
+  });
+  if (wrongWords.length > 0) {
+    tipsEl.innerHTML += `<li>🔴 認識されなかった単語: <strong>${wrongWords.join(', ')}</strong> — ゆっくりはっきり発音してみよう</li>`;
+  }
 
   resultEl.classList.add('show');
-}}
+}
 
 // Simple Levenshtein distance for fuzzy matching
-function levenshtein(a, b) {{
+function levenshtein(a, b) {
   if (a.length === 0) return b.length;
   if (b.length === 0) return a.length;
   const matrix = [];
   for (let i = 0; i <= b.length; i++) matrix[i] = [i];
   for (let j = 0; j <= a.length; j++) matrix[0][j] = j;
-  for (let i = 1; i <= b.length; i++) {{
-    for (let j = 1; j <= a.length; j++) {{
-      if (b.charAt(i - 1) === a.charAt(j - 1)) {{
+  for (let i = 1; i <= b.length; i++) {
+    for (let j = 1; j <= a.length; j++) {
+      if (b.charAt(i - 1) === a.charAt(j - 1)) {
         matrix[i][j] = matrix[i - 1][j - 1];
-      }} else {{
+      } else {
         matrix[i][j] = Math.min(
           matrix[i - 1][j - 1] + 1,
           matrix[i][j - 1] + 1,
           matrix[i - 1][j] + 1
         );
-      }}
-    }}
-  }}
+      }
+    }
+  }
   return matrix[b.length][a.length];
-}}
+}
 
 document.addEventListener('DOMContentLoaded', initPronun);'''
 
 
-def build_day_html(data: dict) -> str:
-    """1日分のHTMLを生成する。"""
+def build_day_html(data: dict, minify: bool = False) -> str:
+    """1日分のHTMLを生成する。minify は参照する共通CSS/JSを minify 版にするだけで、HTML自体は minify_html で縮める。"""
     day = data["day"]
     sweet = data["sweet"]
     emoji = data.get("emoji", "🍰")
@@ -1434,7 +1475,7 @@ def build_day_html(data: dict) -> str:
         section_summary(data),
     ])
 
-    js = build_js(day, sweet)
+    css_href, js_src = app_asset_paths(minify)
 
     return f'''<!DOCTYPE html>
 <html lang="ja">
@@ -1443,11 +1484,9 @@ def build_day_html(data: dict) -> str:
 <meta name="viewport" content="width=device-width, initial-scale=1.0">
 <title>{emoji} Day {day}: {h(sweet)} — Cooking English Custom</title>
 <link href="https://fonts.googleapis.com/css2?family=Zen+Maru+Gothic:wght@400;500;700&family=Quicksand:wght@400;500;600;700&family=Noto+Sans+JP:wght@400;500;700&display=swap" rel="stylesheet">
-<style>
-{CSS}
-</style>
+<link rel="stylesheet" href="{css_href}">
 </head>
-<body>
+<body data-day="{day}" data-sweet="{h(sweet)}">
 
 <div class="header">
   <div class="header-badge">COOKING ENGLISH — CUSTOM EDITION</div>
@@ -1474,9 +1513,7 @@ def build_day_html(data: dict) -> str:
 
 </div>
 
-<script>
-{js}
-</script>
+<script src="{js_src}"></script>
 </body>
 </html>'''
 
@@ -1660,28 +1697,567 @@ body {{
 </html>'''
 
 
-def build_day(day: int):
-    """1日分のHTMLを生成してdocs/に保存する。"""
-    json_path = CONTENT_DIR / f"day{day}.json"
-    if not json_path.exists():
-        print(f"  Skipping Day {day} (no JSON)")
+# ── 差分ビルド ──
+# 日ごとに入力（JSON・このファイル・CSS・JS）のハッシュと出力HTMLのハッシュを .state/build.json に残し、
+# 入力が前回と同じでHTMLも手つかずならスキップする。作り直しても中身が同じなら書き込まない
+# （mtime が変わらないので GitHub Pages の差分も出ない）。
+
+def sha256(data) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def renderer_fingerprint(minify: bool = False) -> dict:
+    """HTMLの出力を左右するコード側の入力のハッシュ。"""
+    return {"renderer": sha256(Path(__file__).read_bytes()), "css": sha256(CSS), "js": sha256(APP_JS),
+            "avatar": sha256(json.dumps(avatar_info(), sort_keys=True)), "minify": minify}
+
+
+# ── アバター画像 ──
+# assets/ryosuke.jpg（1206x1496, 約680KB）を 36px 表示用に正方形へ切り抜き、1x/2x/3x の JPEG と WebP を
+# docs/assets/ に書く。元画像のハッシュを .state/avatar.json に残し、変わったときだけ作り直す。
+
+@functools.lru_cache(maxsize=None)
+def avatar_info():
+    """今の元画像に対応する縮小版の情報。まだ作っていなければ None。
+
+    --jobs のワーカーからも呼ぶので、状態はファイルから読む。
+    """
+    if not AVATAR_STATE.exists() or not AVATAR_SRC.exists():
+        return None
+    with open(AVATAR_STATE, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    return info if info.get("source") == sha256(AVATAR_SRC.read_bytes()) else None
+
+
+def encode_image(image, fmt: str, **options) -> bytes:
+    buf = BytesIO()
+    image.save(buf, fmt, **options)
+    return buf.getvalue()
+
+
+def process_avatar(docs_dir: Path = DOCS_DIR) -> list:
+    """アバターの縮小版を docs_dir/assets/ に書く。書いたパスを返す。"""
+    info = avatar_info()
+    if info and all((docs_dir / f).exists() for f in info["jpeg"] + info["webp"]):
+        return []
+    if Image is None or not AVATAR_SRC.exists():
+        return []
+
+    source = sha256(AVATAR_SRC.read_bytes())
+    stem = f"assets/{AVATAR_SRC.stem}.{source[:10]}"
+    image = ImageOps.exif_transpose(Image.open(AVATAR_SRC)).convert("RGB")
+    outputs = {}
+    info = {"source": source, "jpeg": [], "webp": []}
+    for scale in AVATAR_SCALES:
+        px = AVATAR_SIZE * scale
+        resized = ImageOps.fit(image, (px, px), Image.LANCZOS)
+        info["jpeg"].append(f"{stem}-{px}.jpg")
+        outputs[info["jpeg"][-1]] = encode_image(resized, "JPEG", quality=82, optimize=True, progressive=True)
+        if features.check("webp"):
+            info["webp"].append(f"{stem}-{px}.webp")
+            outputs[info["webp"][-1]] = encode_image(resized, "WEBP", quality=80, method=6)
+    # 読み込むまでの仮の画像。6x6 をブラウザに引き伸ばさせる（ぼけて見えるのでちょうどいい）。
+    # 縮小版は元の Display P3 プロファイルを残すが、仮の画像ではそれだけで本体の数倍になるので落とす
+    tiny = ImageOps.fit(image, (6, 6), Image.LANCZOS)
+    tiny.info.clear()
+    tiny = encode_image(tiny, "PNG", optimize=True)
+    info["placeholder"] = "data:image/png;base64," + base64.b64encode(tiny).decode("ascii")
+
+    written = []
+    for rel, data in outputs.items():
+        path = docs_dir / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if not (path.exists() and path.read_bytes() == data):
+            path.write_bytes(data)
+            written.append(path)
+
+    AVATAR_STATE.parent.mkdir(parents=True, exist_ok=True)
+    with open(AVATAR_STATE, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    avatar_info.cache_clear()
+    return written
+
+
+# ── minify ──
+# 標準ライブラリだけの控えめな minify。落とすのはコメントとインデント・改行などの空白だけで、
+# 文字列・テンプレートリテラル・正規表現・<pre>・<textarea> の中身には触らない。同じ入力からは常に同じ出力になる。
+
+CSS_TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/|\s+|[^"\'/\s]+|/', re.S)
+
+
+def minify_css(css: str) -> str:
+    out = []
+    pending_space = False
+    for token in CSS_TOKEN.findall(css):
+        if token.isspace() or token.startswith("/*"):
+            pending_space = True
+            continue
+        # 区切り記号の前後の空白は要らない。":" の前は残す（"a :hover" と "a:hover" は別物）
+        if pending_space and out and out[-1][-1] not in "{};,>:(" and token[0] not in "{};,>)":
+            out.append(" ")
+        pending_space = False
+        if token[0] == "}" and out and out[-1] == ";":
+            out.pop()
+        # 区切り記号ごとに別の要素にして、直前が ";" だけかどうかを見られるようにする
+        out.extend(re.findall(r"[{};,>]|[^{};,>]+", token) if token[0] not in "\"'" else [token])
+    return "".join(out)
+
+
+JS_REGEX_AFTER = set("(,=:[!&|?{};+-*%<>~^")
+JS_SPACE_FREE = set("{}()[];,=:<>!&|?")
+
+
+def _js_skip_string(js: str, i: int) -> int:
+    """js[i] の引用符で始まる文字列の、閉じ引用符の次の位置。"""
+    quote = js[i]
+    i += 1
+    while js[i] != quote:
+        i += 2 if js[i] == "\\" else 1
+    return i + 1
+
+
+def _js_skip_template(js: str, i: int) -> int:
+    """js[i] のバッククォートで始まるテンプレートリテラルの終わりの次の位置（${...} の入れ子も追う）。"""
+    i += 1
+    while js[i] != "`":
+        if js[i] == "\\":
+            i += 2
+        elif js.startswith("${", i):
+            i += 2
+            depth = 1
+            while depth:
+                if js[i] in "'\"":
+                    i = _js_skip_string(js, i)
+                    continue
+                if js[i] == "`":
+                    i = _js_skip_template(js, i)
+                    continue
+                depth += {"{": 1, "}": -1}.get(js[i], 0)
+                i += 1
+        else:
+            i += 1
+    return i + 1
+
+
+def _js_skip_regex(js: str, i: int) -> int:
+    """js[i] の / で始まる正規表現リテラル（フラグ込み）の終わりの次の位置。"""
+    i += 1
+    in_class = False
+    while in_class or js[i] != "/":
+        if js[i] == "\\":
+            i += 1
+        elif js[i] == "[":
+            in_class = True
+        elif js[i] == "]":
+            in_class = False
+        i += 1
+    i += 1
+    while i < len(js) and js[i].isalpha():
+        i += 1
+    return i
+
+
+def minify_js(js: str) -> str:
+    """コメントを落とし、空白をまとめる。改行は ASI に効くので、明らかに要らない所以外は1つ残す。"""
+    out = []
+    i, n = 0, len(js)
+    space = ""
+    while i < n:
+        c = js[i]
+        if c.isspace() or js.startswith("//", i) or js.startswith("/*", i):
+            if js.startswith("//", i):
+                end = js.find("\n", i)
+                i = n if end == -1 else end
+            elif js.startswith("/*", i):
+                end = js.index("*/", i + 2) + 2
+                space = space or ("\n" if "\n" in js[i:end] else " ")
+                i = end
+            else:
+                space = "\n" if c == "\n" or space == "\n" else " "
+                i += 1
+            continue
+
+        prev = out[-1][-1] if out else ""
+        if space and prev:
+            if space == "\n":
+                keep = prev not in "{;,([=:?&|" and c not in "})];,.?:"
+            else:
+                keep = prev not in JS_SPACE_FREE and c not in JS_SPACE_FREE
+            if keep:
+                out.append(space)
+        space = ""
+
+        if c in "'\"":
+            end = _js_skip_string(js, i)
+        elif c == "`":
+            end = _js_skip_template(js, i)
+        elif c == "/" and (not prev or prev in JS_REGEX_AFTER or re.search(r"\b(return|typeof|case)$", out[-1])):
+            end = _js_skip_regex(js, i)
+        else:
+            end = i + 1
+        out.append(js[i:end])
+        i = end
+    return "".join(out)
+
+
+HTML_TOKEN = re.compile(
+    r"<!--.*?-->"
+    r"|<(pre|textarea|script|style)\b(?:[^>\"']|\"[^\"]*\"|'[^']*')*>.*?</\1\s*>"
+    r"|<(?:[^>\"']|\"[^\"]*\"|'[^']*')*>"
+    r"|[^<]+|<",
+    re.S | re.I,
+)
+HTML_RAW = re.compile(r"(<(\w+)\b(?:[^>\"']|\"[^\"]*\"|'[^']*')*>)(.*)(</\w+\s*>)", re.S)
+TAG_PART = re.compile(r"\"[^\"]*\"|'[^']*'|\s+|[^\"'\s]+")
+
+
+def _minify_tag(tag: str) -> str:
+    """タグの中の空白をまとめる。属性値（onclick の JS なども）はそのまま。"""
+    parts = ["" if part.isspace() else part for part in TAG_PART.findall(tag)]
+    out = ""
+    for part in parts:
+        if not part:
+            out += " "
+        elif out.endswith(" ") and part[0] in "/>":
+            out = out.rstrip() + part
+        else:
+            out += part
+    return re.sub(" +", " ", out)
+
+
+def _collapse_edge(space: str) -> str:
+    return "\n" if "\n" in space else " "
+
+
+def minify_html(html: str) -> str:
+    """コメントとインデントを落とし、<script> / <style> の中身を minify する。
+
+    テキストの中の空白は textContent でコピーや読み上げに使うので触らず、前後の空白だけを1文字にまとめる
+    （空白が全く無い所と1つある所では表示が変わりうるので、消しはしない）。<pre> / <textarea> はそのまま。
+    """
+    out = []
+    for match in HTML_TOKEN.finditer(html):
+        token = match.group(0)
+        if token.startswith("<!--"):
+            continue
+        raw = match.group(1)
+        if raw:
+            open_tag, name, body, close_tag = HTML_RAW.match(token).groups()
+            name = name.lower()
+            if name == "script" and "src=" not in open_tag:
+                body = minify_js(body)
+            elif name == "style":
+                body = minify_css(body)
+            out.append(_minify_tag(open_tag) + body + close_tag)
+        elif token.startswith("<") and len(token) > 1:
+            out.append(_minify_tag(token))
+        elif token.isspace():
+            out.append(_collapse_edge(token))
+        else:
+            head = re.match(r"\s*", token).group(0)
+            tail = re.search(r"\s*$", token[len(head):]).group(0)
+            core = token[len(head):len(token) - len(tail)]
+            out.append((_collapse_edge(head) if head else "") + core + (_collapse_edge(tail) if tail else ""))
+    return "".join(out).strip()
+
+
+# ── 共通CSS/JS ──
+# 全ページ同じ CSS と APP_JS は中身のハッシュ入りの名前で assets/ に1回だけ書き、各ページから参照する。
+# 中身が変わればファイル名も変わるので、ブラウザには長くキャッシュさせてよい。
+
+@functools.lru_cache(maxsize=None)
+def app_assets(minify: bool = False) -> dict:
+    """{docs からの相対パス: 中身} を返す。"""
+    texts = (("css", minify_css(CSS)), ("js", minify_js(APP_JS))) if minify else (("css", CSS), ("js", APP_JS))
+    return {f"assets/app.{sha256(text)[:10]}.{ext}": text for ext, text in texts}
+
+
+def app_asset_paths(minify: bool = False) -> tuple:
+    """(CSSのパス, JSのパス)"""
+    css, js = app_assets(minify)
+    return css, js
+
+
+def write_app_assets(docs_dir: Path = DOCS_DIR, minify: bool = False) -> list:
+    """app.<hash>.css / .js を書く。書いたパスを返す（古いハッシュのものは prune_assets で消す）。"""
+    assets = app_assets(minify)
+    written = []
+    for rel, text in assets.items():
+        path = docs_dir / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if write_if_changed(path, text):
+            written.append(path)
+    return written
+
+
+def prune_assets(docs_dir: Path = DOCS_DIR) -> list:
+    """どのページからも参照されていない app.<hash>.css / .js とアバター画像を消す。消したパスを返す。
+
+    作り直さなかったページは古いハッシュの名前を参照したままなので、参照が無くなったものだけを消す
+    （--day の部分ビルドでも他の日のページを壊さない）。ページを書き終えてから呼ぶ。
+    """
+    assets_dir = docs_dir / "assets"
+    if not assets_dir.exists():
+        return []
+    referenced = set()
+    for page in docs_dir.glob("*.html"):
+        referenced.update(re.findall(r"assets/[\w.-]+", page.read_text(encoding="utf-8")))
+    candidates = [p for p in assets_dir.glob("app.*.*") if p.suffix in (".css", ".js")]
+    candidates += [p for p in assets_dir.glob(f"{AVATAR_SRC.stem}.*-*") if p.suffix in (".jpg", ".webp")]
+    if avatar_info():
+        # 縮小版に置き換わった元の画像（copy_assets はもうコピーしない）
+        candidates.append(assets_dir / AVATAR_SRC.name)
+    removed = []
+    for path in sorted(candidates):
+        if path.exists() and f"assets/{path.name}" not in referenced:
+            path.unlink()
+            remove_compressed(path)
+            removed.append(path)
+    return removed
+
+
+def load_manifest() -> dict:
+    if not BUILD_MANIFEST.exists():
+        return {"days": {}}
+    with open(BUILD_MANIFEST, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def saved_minify() -> bool:
+    """前回の build_html.py で --minify したかどうか。
+
+    ページごとに minify の有無が混ざると、参照する共通CSS/JSも食い違うので、
+    --day の部分ビルドや generate_content.py --build はこの設定に合わせる。
+    """
+    return load_manifest().get("minify", False)
+
+
+def save_manifest(manifest: dict):
+    BUILD_MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+    tmp = BUILD_MANIFEST.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, BUILD_MANIFEST)
+
+
+def write_if_changed(path: Path, text: str) -> bool:
+    """中身が変わるときだけ書く。書いたら True。
+
+    隣に圧縮済みファイル（.gz / .br）があれば一緒に作り直す（--compress を付けないビルドでも古いまま残さない）。
+    """
+    if path.exists() and path.read_text(encoding="utf-8") == text:
         return False
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    refresh_compressed(path, text.encode("utf-8"))
+    return True
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
 
-    html = build_day_html(data)
-    out_path = DOCS_DIR / f"day{day}.html"
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(html)
-    print(f"  Built: {out_path}")
-    return True
+def write_day_html(data: dict, docs_dir: Path = DOCS_DIR, minify: bool = False) -> Path:
+    """1日分のdictからHTMLを生成して docs_dir/dayN.html に書く（同じ内容なら書かない）。"""
+    out_path = docs_dir / f"day{data['day']}.html"
+    html = build_day_html(data, minify)
+    write_if_changed(out_path, minify_html(html) if minify else html)
+    return out_path
+
+
+def write_index(available_days: list, docs_dir: Path = DOCS_DIR, minify: bool = False) -> Path:
+    """index.html を書く（同じ内容なら書かない）。"""
+    index_path = docs_dir / "index.html"
+    html = build_index_html(available_days)
+    write_if_changed(index_path, minify_html(html) if minify else html)
+    return index_path
+
+
+def copy_assets(docs_dir: Path = DOCS_DIR, minify: bool = False) -> list:
+    """assets/ を docs_dir/assets/ にコピーし、アバターの縮小版と共通CSS/JSを書く。
+
+    中身が同じファイルは触らない。縮小版ができていれば、どのページからも参照しない元のアバター画像はコピーしない。
+    書いたパスを返す。
+    """
+    docs_dir.mkdir(parents=True, exist_ok=True)
+    assets_src = BASE_DIR / "assets"
+    assets_dst = docs_dir / "assets"
+    copied = process_avatar(docs_dir)
+    if assets_src.exists():
+        assets_dst.mkdir(exist_ok=True)
+        import shutil
+        for f in assets_src.iterdir():
+            if f == AVATAR_SRC and avatar_info():
+                continue
+            target = assets_dst / f.name
+            if f.is_file() and not (target.exists() and target.read_bytes() == f.read_bytes()):
+                shutil.copy2(f, target)
+                copied.append(target)
+    return copied + write_app_assets(docs_dir, minify)
+
+
+# ── 圧縮済みファイル ──
+# 静的サーバや CDN がその場で圧縮しなくて済むよう、テキストの出力の隣に .gz（brotli があれば .br も）を置く。
+# 元ファイルのハッシュを manifest の "compressed" に残し、変わったものだけ圧縮し直す。
+
+def gzip_bytes(raw: bytes) -> bytes:
+    # mtime=0 でヘッダに時刻を入れず、同じ入力からは同じバイト列にする
+    return gzip.compress(raw, compresslevel=9, mtime=0)
+
+
+def refresh_compressed(path: Path, raw: bytes):
+    """path の隣にすでにある .gz / .br を raw から作り直す。brotli が無くて作れない .br は消す。"""
+    gz = path.with_name(path.name + ".gz")
+    if gz.exists():
+        gz.write_bytes(gzip_bytes(raw))
+    br = path.with_name(path.name + ".br")
+    if br.exists():
+        if brotli is not None:
+            br.write_bytes(brotli.compress(raw, quality=11))
+        else:
+            br.unlink()
+
+
+def remove_compressed(path: Path):
+    for suffix in (".gz", ".br"):
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+
+def compress_outputs(manifest: dict, docs_dir: Path = DOCS_DIR) -> list:
+    """docs_dir 以下のテキスト出力を圧縮する。圧縮し直したファイルの (パス, 元, gz, br) を返す。"""
+    done = manifest.setdefault("compressed", {})
+    sources = sorted(p for p in docs_dir.rglob("*") if p.is_file() and p.suffix in COMPRESS_SUFFIXES)
+    results = []
+    for path in sources:
+        rel = path.relative_to(docs_dir).as_posix()
+        raw = path.read_bytes()
+        digest = sha256(raw)
+        siblings = [path.with_name(path.name + ".gz")]
+        if brotli is not None:
+            siblings.append(path.with_name(path.name + ".br"))
+        if done.get(rel) == digest and all(p.exists() for p in siblings):
+            continue
+        gz = gzip_bytes(raw)
+        siblings[0].write_bytes(gz)
+        br = None
+        if brotli is not None:
+            br = brotli.compress(raw, quality=11)
+            siblings[1].write_bytes(br)
+        done[rel] = digest
+        results.append((path, len(raw), len(gz), None if br is None else len(br)))
+
+    # 元が無くなった（古いハッシュの app.*.css など）圧縮ファイルは消す
+    live = {p.relative_to(docs_dir).as_posix() for p in sources}
+    for sibling in [*docs_dir.rglob("*.gz"), *docs_dir.rglob("*.br")]:
+        rel = sibling.relative_to(docs_dir).as_posix()[:-3]
+        if rel not in live:
+            sibling.unlink()
+            done.pop(rel, None)
+    return results
+
+
+def print_compression(results: list, docs_dir: Path = DOCS_DIR):
+    for path, raw, gz, br in results:
+        line = f"  Compressed: {path.relative_to(docs_dir)} {raw:,} B → gz {gz:,} B ({gz / raw:.1%})"
+        if br is not None:
+            line += f", br {br:,} B ({br / raw:.1%})"
+        print(line)
+    if results:
+        raw = sum(r[1] for r in results)
+        gz = sum(r[2] for r in results)
+        print(f"  Compressed {len(results)} file(s): {raw:,} B → gz {gz:,} B ({gz / raw:.1%})"
+              + ("" if brotli is not None else "  (brotli not installed: .gz only)"))
+
+
+def render_day(day: int, entry: dict, code: dict, content_dir: Path = CONTENT_DIR,
+               docs_dir: Path = DOCS_DIR) -> tuple:
+    """1日分のHTMLを（必要なら）作って書く。ログも manifest の更新もしない。
+
+    --jobs でワーカープロセスから呼ぶので、引数も戻り値も pickle できるものだけにする。
+    entry は前回の manifest のその日の分。(status, 新しい entry または None, 出力パス, minify で減ったバイト数) を返す。
+    status は "built" / "unchanged"（作り直したが同じ内容）/ "skipped" / "missing"（JSONが無い）。
+    """
+    json_path = content_dir / f"day{day}.json"
+    if not json_path.exists():
+        return "missing", None, None, None
+
+    raw = json_path.read_bytes()
+    data = json.loads(raw)
+    out_path = docs_dir / f"day{day}.html"
+    inputs = {"json": sha256(raw), **code}
+    if (entry.get("inputs") == inputs and out_path.exists()
+            and sha256(out_path.read_text(encoding="utf-8")) == entry.get("html")):
+        return "skipped", None, out_path, None
+
+    html = build_day_html(data, code.get("minify", False))
+    saved = None
+    if code.get("minify"):
+        full = html
+        html = minify_html(full)
+        saved = len(full.encode("utf-8")) - len(html.encode("utf-8"))
+    written = write_if_changed(out_path, html)
+    return ("built" if written else "unchanged"), {"inputs": inputs, "html": sha256(html)}, out_path, saved
+
+
+def log_day(day: int, status: str, out_path: Path, saved: int = None):
+    if status == "missing":
+        print(f"  Skipping Day {day} (no JSON)")
+    elif status in ("built", "unchanged"):
+        note = "" if saved is None else f" (minify -{saved:,} B)"
+        print(f"  {'Built' if status == 'built' else 'Unchanged'}: {out_path}{note}")
+
+
+def build_day(day: int, manifest: dict = None, code: dict = None) -> str:
+    """1日分のHTMLを生成してdocs/に保存する。
+
+    manifest を渡すと、入力が前回と同じで出力も手つかずの日はスキップし、結果を manifest に書き込む。
+    戻り値は render_day の status。
+    """
+    entry = (manifest or {}).get("days", {}).get(str(day), {})
+    status, new_entry, out_path, saved = render_day(day, entry, code or renderer_fingerprint())
+    if manifest is not None and new_entry is not None:
+        manifest.setdefault("days", {})[str(day)] = new_entry
+    log_day(day, status, out_path, saved)
+    return status
+
+
+def build_days(days: list, manifest: dict, code: dict = None, jobs: int = 1, content_dir: Path = CONTENT_DIR,
+               docs_dir: Path = DOCS_DIR, quiet: bool = False) -> dict:
+    """複数日をまとめてビルドし、{day: status} を返す。
+
+    jobs > 1 ならプロセスプールで並列に描画する。結果は日の順に親へ戻してからログと manifest の更新を
+    行うので、出力も .state/build.json も直列と同じになる。
+    """
+    code = code or renderer_fingerprint()
+    entries = [manifest.get("days", {}).get(str(day), {}) for day in days]
+    args = (days, entries, [code] * len(days), [content_dir] * len(days), [docs_dir] * len(days))
+    if jobs > 1 and len(days) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # 1回ずつ往復すると pickle の手間が描画に比べて無視できないので、まとめて渡す
+            results = list(pool.map(render_day, *args, chunksize=max(1, len(days) // (jobs * 4))))
+    else:
+        results = list(map(render_day, *args))
+
+    statuses = {}
+    for day, (status, new_entry, out_path, saved) in zip(days, results):
+        if new_entry is not None:
+            manifest.setdefault("days", {})[str(day)] = new_entry
+        if not quiet:
+            log_day(day, status, out_path, saved)
+        statuses[day] = status
+    return statuses
 
 
 def main():
     parser = argparse.ArgumentParser(description="JSON → HTML生成")
     parser.add_argument("--day", type=int, help="特定の日だけ生成")
     parser.add_argument("--all", action="store_true", help="全日分生成")
+    parser.add_argument("--force", action="store_true", help="前回のビルド結果を無視してすべて作り直す")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="並列に描画するプロセス数 (デフォルト: 1 = 直列、0 = CPU数)")
+    parser.add_argument("--compress", action="store_true",
+                        help="HTML/CSS/JS/JSON の隣に圧縮済みの .gz（brotli があれば .br も）を書く")
+    parser.add_argument("--minify", action=argparse.BooleanOptionalAction, default=None,
+                        help="HTML・共通CSS/JSからコメントとインデントを落とす（標準ライブラリのみ、出力は毎回同じ）。"
+                             "指定しなければ前回のビルドの設定を引き継ぐ")
     args = parser.parse_args()
 
     if not args.day and not args.all:
@@ -1689,19 +2265,14 @@ def main():
         print("       python build_html.py --all     (全日分)")
         sys.exit(0)
 
-    # Create output directories
-    DOCS_DIR.mkdir(exist_ok=True)
-    assets_src = BASE_DIR / "assets"
-    assets_dst = DOCS_DIR / "assets"
+    started = time.monotonic()
+    previous = load_manifest()
+    minify = previous.get("minify", False) if args.minify is None else args.minify
 
-    # Copy assets to docs/
-    if assets_src.exists():
-        assets_dst.mkdir(exist_ok=True)
-        import shutil
-        for f in assets_src.iterdir():
-            if f.is_file():
-                shutil.copy2(f, assets_dst / f.name)
-        print(f"  Copied assets to {assets_dst}")
+    # Create output directories and copy assets to docs/
+    copied = copy_assets(minify=minify)
+    if copied:
+        print(f"  Copied {len(copied)} asset(s) to {DOCS_DIR / 'assets'}")
 
     # Build day pages
     available_days = []
@@ -1710,8 +2281,14 @@ def main():
     else:
         days = list(range(1, TOTAL_DAYS + 1))
 
-    for day in days:
-        if build_day(day):
+    manifest = {"days": {}} if args.force else previous
+    manifest["minify"] = minify
+    code = renderer_fingerprint(minify)
+    counts = {}
+    jobs = args.jobs or os.cpu_count() or 1
+    for day, status in build_days(days, manifest, code, jobs=jobs).items():
+        counts[status] = counts.get(status, 0) + 1
+        if status != "missing":
             available_days.append(day)
 
     # Also scan for any previously built days
@@ -1722,12 +2299,25 @@ def main():
         available_days = sorted(set(available_days))
 
     # Build index
-    index_html = build_index_html(available_days)
     index_path = DOCS_DIR / "index.html"
-    with open(index_path, "w", encoding="utf-8") as f:
-        f.write(index_html)
-    print(f"  Built: {index_path}")
-    print(f"\nDone! {len(available_days)} day(s) built. Open docs/index.html to view.")
+    index_html = build_index_html(available_days)
+    note = ""
+    if minify:
+        full = index_html
+        index_html = minify_html(full)
+        note = f" (minify -{len(full.encode('utf-8')) - len(index_html.encode('utf-8')):,} B)"
+    if write_if_changed(index_path, index_html):
+        print(f"  Built: {index_path}{note}")
+    removed = prune_assets()
+    if removed:
+        print(f"  Removed {len(removed)} unreferenced asset(s): {', '.join(p.name for p in removed)}")
+
+    if args.compress:
+        print_compression(compress_outputs(manifest))
+    save_manifest(manifest)
+    summary = ", ".join(f"{count} {status}" for status, count in counts.items() if status != "missing")
+    print(f"\nDone! {len(available_days)} day(s) ({summary}) in {time.monotonic() - started:.3f}s. "
+          f"Open docs/index.html to view.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,371 @@
+let currentSpeed = 0.85;
+let repeatCounts = {};
+
+function toggleSection(header) {
+  const card = header.parentElement;
+  card.classList.toggle('open');
+  const index = parseInt(card.dataset.index);
+  const dots = document.querySelectorAll('.progress-dot');
+  if (card.classList.contains('open')) {
+    dots[index].classList.add('active');
+    for (let i = 0; i < index; i++) { dots[i].classList.add('complete'); dots[i].classList.remove('active'); }
+  }
+  const openCards = document.querySelectorAll('.section-card.open');
+  document.querySelector('.progress-label').textContent = openCards.length + ' / ' + dots.length + ' セクション';
+}
+
+function toggleVocab(btn) {
+  const list = btn.nextElementSibling;
+  list.classList.toggle('show');
+  btn.textContent = list.classList.contains('show') ? '📚 単語リストを隠す' : '📚 単語リストを見る';
+}
+
+function checkQuiz(option, isCorrect) {
+  const parent = option.parentElement;
+  if (parent.dataset.answered) return;
+  parent.dataset.answered = 'true';
+  const allOptions = parent.querySelectorAll('.quiz-option');
+  allOptions.forEach(opt => opt.style.pointerEvents = 'none');
+  if (isCorrect) {
+    option.classList.add('correct');
+    parent.nextElementSibling.classList.add('show');
+  } else {
+    option.classList.add('wrong');
+    parent.nextElementSibling.nextElementSibling.classList.add('show');
+  }
+}
+
+// Web Speech API TTS
+function speakText(elementId, btn) {
+  if (window.speechSynthesis.speaking) {
+    window.speechSynthesis.cancel();
+    btn.textContent = '🔊 再生';
+    btn.classList.remove('playing');
+    return;
+  }
+  const text = document.getElementById(elementId).textContent;
+  const utterance = new SpeechSynthesisUtterance(text);
+  utterance.lang = 'en-AU';
+  utterance.rate = currentSpeed;
+  utterance.pitch = 1;
+
+  const voices = window.speechSynthesis.getVoices();
+  const enVoice = voices.find(v => v.lang.startsWith('en-AU')) ||
+                  voices.find(v => v.lang.startsWith('en-GB')) ||
+                  voices.find(v => v.lang.startsWith('en'));
+  if (enVoice) utterance.voice = enVoice;
+
+  btn.textContent = '⏹ 停止';
+  btn.classList.add('playing');
+
+  if (!repeatCounts[elementId]) repeatCounts[elementId] = 0;
+  repeatCounts[elementId]++;
+  const repeatEl = btn.parentElement.querySelector('.repeat-count');
+  if (repeatEl) repeatEl.textContent = '再生回数: ' + repeatCounts[elementId];
+
+  utterance.onend = () => { btn.textContent = '🔊 再生'; btn.classList.remove('playing'); };
+  utterance.onerror = () => { btn.textContent = '🔊 再生'; btn.classList.remove('playing'); };
+  window.speechSynthesis.speak(utterance);
+}
+
+window.speechSynthesis.onvoiceschanged = () => window.speechSynthesis.getVoices();
+
+function checkAllGaps(btn) {
+  const box = btn.closest('.listening-box');
+  const inputs = box.querySelectorAll('input[data-answer]');
+  inputs.forEach(input => {
+    const correct = input.dataset.answer.toLowerCase();
+    const val = input.value.trim().toLowerCase();
+    input.classList.remove('correct-input', 'wrong-input');
+    if (val === correct) { input.classList.add('correct-input'); }
+    else { input.classList.add('wrong-input'); }
+  });
+  const answer = box.querySelector('.listening-answer');
+  if (answer) answer.classList.add('show');
+}
+
+function toggleScript(btn) {
+  const script = btn.nextElementSibling;
+  script.classList.toggle('show');
+  btn.textContent = script.classList.contains('show') ? '📝 スクリプトを隠す' : '📝 スクリプトを見る';
+}
+
+function copyText(id) {
+  const text = document.getElementById(id).textContent;
+  navigator.clipboard.writeText(text).then(() => alert('コピーしました！'));
+}
+
+function generateSummary() {
+  const checked = document.querySelectorAll('.vocab-item.checked');
+  const vocabList = Array.from(checked).map(i => i.querySelector('.vocab-en').textContent);
+  const tryIt = document.getElementById('tryit-text').value;
+  const listeningPlays = Object.entries(repeatCounts).map(([k,v]) => k + ': ' + v + '回').join(', ');
+
+  let s = `【Day ${document.body.dataset.day}: ${document.body.dataset.sweet} 学習サマリー】\n\n`;
+  s += `■ チェックした単語 (${vocabList.length}個):\n${vocabList.length > 0 ? vocabList.join(', ') : 'なし'}\n\n`;
+  s += `■ リスニング再生回数:\n${listeningPlays || '未再生'}\n\n`;
+
+  const pronunSummary = pronunResults.filter(r => r).map((r, i) =>
+    `  ${i+1}. "${r.target}" → ${r.score}% (認識: "${r.heard}")`
+  ).join('\n');
+  s += `■ 発音チェック結果:\n${pronunSummary || '(未実施)'}\n\n`;
+
+  s += `■ Today's Writing:\n${tryIt || '(未記入)'}\n\n`;
+  s += `---\n上の内容をもとに、以下を教えてください：\n1. チェックした単語の使い方（例文付き）\n2. 発音チェックで間違えた部分のアドバイス\n3. Today's Writingの添削\n4. 今日学んだフレーズの発展表現`;
+
+  const output = document.getElementById('summary-output');
+  output.textContent = s;
+  output.classList.add('show');
+}
+
+function copySummary() {
+  const text = document.getElementById('summary-output').textContent;
+  navigator.clipboard.writeText(text).then(() => alert('コピーしました！'));
+}
+
+document.querySelectorAll('.progress-dot').forEach(dot => {
+  dot.addEventListener('click', () => {
+    const index = parseInt(dot.dataset.section);
+    const cards = document.querySelectorAll('.section-card');
+    if (cards[index]) {
+      cards[index].scrollIntoView({ behavior: 'smooth', block: 'start' });
+      if (!cards[index].classList.contains('open')) toggleSection(cards[index].querySelector('.section-header'));
+    }
+  });
+});
+
+// ===== PRONUNCIATION CHECK =====
+// pronunSentences is defined in the HTML before this script
+
+let currentPronunIndex = 0;
+let pronunResults = [];
+let pronunRecognition = null;
+let isRecording = false;
+
+function initPronun() {
+  renderPronunSentence();
+  updatePronunNav();
+}
+
+function renderPronunSentence() {
+  const target = document.getElementById('pronun-target');
+  const sentence = pronunSentences[currentPronunIndex];
+  const words = sentence.text.split(' ');
+  target.innerHTML = words.map((w, i) => `<span class="word" data-index="${i}">${w}</span>`).join(' ');
+
+  const result = document.getElementById('pronun-result');
+  result.classList.remove('show', 'good', 'needs-work', 'try-again');
+}
+
+function updatePronunNav() {
+  document.getElementById('pronun-counter').textContent =
+    `${currentPronunIndex + 1} / ${pronunSentences.length}`;
+  document.getElementById('pronun-prev').classList.toggle('disabled', currentPronunIndex === 0);
+  document.getElementById('pronun-next').classList.toggle('disabled', currentPronunIndex === pronunSentences.length - 1);
+}
+
+function changePronunSentence(dir) {
+  const newIndex = currentPronunIndex + dir;
+  if (newIndex < 0 || newIndex >= pronunSentences.length) return;
+  currentPronunIndex = newIndex;
+  renderPronunSentence();
+  updatePronunNav();
+}
+
+function speakPronunSentence() {
+  if (window.speechSynthesis.speaking) {
+    window.speechSynthesis.cancel();
+    return;
+  }
+  const text = pronunSentences[currentPronunIndex].text;
+  const utterance = new SpeechSynthesisUtterance(text);
+  utterance.lang = 'en-AU';
+  utterance.rate = 0.85;
+  const voices = window.speechSynthesis.getVoices();
+  const enVoice = voices.find(v => v.lang.startsWith('en-AU')) ||
+                  voices.find(v => v.lang.startsWith('en-GB')) ||
+                  voices.find(v => v.lang.startsWith('en'));
+  if (enVoice) utterance.voice = enVoice;
+  window.speechSynthesis.speak(utterance);
+}
+
+function togglePronunRecording() {
+  if (!('webkitSpeechRecognition' in window) && !('SpeechRecognition' in window)) {
+    alert('お使いのブラウザは音声認識に対応していません。Chrome をお使いください。');
+    return;
+  }
+
+  if (isRecording) {
+    stopPronunRecording();
+    return;
+  }
+
+  const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
+  pronunRecognition = new SpeechRecognition();
+  pronunRecognition.lang = 'en-AU';
+  pronunRecognition.interimResults = false;
+  pronunRecognition.maxAlternatives = 3;
+  pronunRecognition.continuous = false;
+
+  const btn = document.getElementById('pronun-btn');
+  btn.textContent = '⏹ 録音中...';
+  btn.classList.add('recording');
+  isRecording = true;
+
+  pronunRecognition.onresult = (event) => {
+    const results = event.results[0];
+    const heard = results[0].transcript;
+    const confidence = results[0].confidence;
+    const alternatives = [];
+    for (let i = 0; i < results.length; i++) {
+      alternatives.push(results[i].transcript.toLowerCase());
+    }
+    evaluatePronunciation(heard, confidence, alternatives);
+    stopPronunRecording();
+  };
+
+  pronunRecognition.onerror = (event) => {
+    stopPronunRecording();
+    if (event.error === 'no-speech') {
+      alert('音声が検出されませんでした。もう少し大きな声ではっきり話してみてください。');
+    } else if (event.error === 'not-allowed') {
+      alert('マイクの使用が許可されていません。ブラウザの設定でマイクを許可してください。');
+    } else {
+      alert('音声認識エラー: ' + event.error);
+    }
+  };
+
+  pronunRecognition.onend = () => {
+    stopPronunRecording();
+  };
+
+  pronunRecognition.start();
+}
+
+function stopPronunRecording() {
+  const btn = document.getElementById('pronun-btn');
+  btn.textContent = '🎤 もう一回';
+  btn.classList.remove('recording');
+  isRecording = false;
+  if (pronunRecognition) {
+    try { pronunRecognition.stop(); } catch(e) {}
+  }
+}
+
+function normalizeText(text) {
+  return text.toLowerCase()
+    .replace(/[.,!?;:'"()\-]/g, '')
+    .replace(/\s+/g, ' ')
+    .trim();
+}
+
+function evaluatePronunciation(heard, confidence, alternatives) {
+  const target = pronunSentences[currentPronunIndex].text;
+  const tip = pronunSentences[currentPronunIndex].tip;
+
+  const targetWords = normalizeText(target).split(' ');
+  const heardWords = normalizeText(heard).split(' ');
+
+  const allHeardWords = new Set();
+  alternatives.forEach(alt => {
+    normalizeText(alt).split(' ').forEach(w => allHeardWords.add(w));
+  });
+
+  let correctCount = 0;
+  const wordElements = document.querySelectorAll('#pronun-target .word');
+
+  targetWords.forEach((targetWord, i) => {
+    const el = wordElements[i];
+    if (!el) return;
+
+    el.classList.remove('correct', 'wrong', 'missed');
+
+    const targetClean = targetWord.toLowerCase();
+
+    if (heardWords.includes(targetClean) || allHeardWords.has(targetClean)) {
+      el.classList.add('correct');
+      correctCount++;
+    } else {
+      const similar = heardWords.some(hw => levenshtein(hw, targetClean) <= 1) ||
+                      [...allHeardWords].some(hw => levenshtein(hw, targetClean) <= 1);
+      if (similar) {
+        el.classList.add('correct');
+        correctCount++;
+      } else {
+        el.classList.add('wrong');
+      }
+    }
+  });
+
+  const score = Math.round((correctCount / targetWords.length) * 100);
+
+  pronunResults[currentPronunIndex] = { score, heard, target };
+
+  const resultEl = document.getElementById('pronun-result');
+  const scoreCircle = document.getElementById('pronun-score-circle');
+  const scoreLabel = document.getElementById('pronun-score-label');
+  const scoreDetail = document.getElementById('pronun-score-detail');
+  const heardEl = document.getElementById('pronun-heard');
+  const tipsEl = document.getElementById('pronun-tips');
+
+  scoreCircle.textContent = score + '%';
+  scoreCircle.classList.remove('high', 'mid', 'low');
+  resultEl.classList.remove('good', 'needs-work', 'try-again');
+
+  if (score >= 80) {
+    scoreCircle.classList.add('high');
+    scoreLabel.textContent = '🎉 Great!';
+    scoreDetail.textContent = 'しっかり通じる発音です！';
+    resultEl.classList.add('good');
+  } else if (score >= 50) {
+    scoreCircle.classList.add('mid');
+    scoreLabel.textContent = '👍 Almost!';
+    scoreDetail.textContent = 'もう少し！赤い単語を意識してみよう。';
+    resultEl.classList.add('needs-work');
+  } else {
+    scoreCircle.classList.add('low');
+    scoreLabel.textContent = '💪 Keep trying!';
+    scoreDetail.textContent = 'お手本を聴いてからもう一回チャレンジ！';
+    resultEl.classList.add('try-again');
+  }
+
+  heardEl.innerHTML = `<strong>🎧 認識された音声:</strong> "${heard}"`;
+  tipsEl.innerHTML = `<li>💡 ${tip}</li>`;
+
+  const wrongWords = [];
+  wordElements.forEach((el, i) => {
+    if (el.classList.contains('wrong') && targetWords[i]) {
+      wrongWords.push(targetWords[i]);
+    }
+  });
+  if (wrongWords.length > 0) {
+    tipsEl.innerHTML += `<li>🔴 認識されなかった単語: <strong>${wrongWords.join(', ')}</strong> — ゆっくりはっきり発音してみよう</li>`;
+  }
+
+  resultEl.classList.add('show');
+}
+
+// Simple Levenshtein distance for fuzzy matching
+function levenshtein(a, b) {
+  if (a.length === 0) return b.length;
+  if (b.length === 0) return a.length;
+  const matrix = [];
+  for (let i = 0; i <= b.length; i++) matrix[i] = [i];
+  for (let j = 0; j <= a.length; j++) matrix[0][j] = j;
+  for (let i = 1; i <= b.length; i++) {
+    for (let j = 1; j <= a.length; j++) {
+      if (b.charAt(i - 1) === a.charAt(j - 1)) {
+        matrix[i][j] = matrix[i - 1][j - 1];
+      } else {
+        matrix[i][j] = Math.min(
+          matrix[i - 1][j - 1] + 1,
+          matrix[i][j - 1] + 1,
+          matrix[i - 1][j] + 1
+        );
+      }
+    }
+  }
+  return matrix[b.length][a.length];
+}
+
+document.addEventListener('DOMContentLoaded', initPronun);
\ No newline at end of file
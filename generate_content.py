@@ -2,15 +2,22 @@
 """
 generate_content.py
 Claude API (Sonnet) を使って30日分のJSONコンテンツを自動生成する。
-Usage: python generate_content.py [--day N] [--all]
+Usage: python generate_content.py [--day N] [--all] [--concurrency N] [--batch]
 """
 
 import json
+import hashlib
 import os
 import sys
+import time
+import random
+import asyncio
 import argparse
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 
+import build_html
+
 try:
     import anthropic
 except ImportError:
@@ -18,6 +25,39 @@ except ImportError:
     print("  pip install anthropic")
     sys.exit(1)
 
+MODEL = "claude-sonnet-4-5-20250514"
+MAX_TOKENS = 8000
+BASE_DIR = Path(__file__).parent
+OUTPUT_DIR = BASE_DIR / "content"
+STATE_DIR = BASE_DIR / ".state"
+BATCH_MANIFEST = STATE_DIR / "batch.json"
+RUN_MANIFEST = STATE_DIR / "manifest.json"
+CACHE_DIR = STATE_DIR / "cache"
+INVALID_DIR = STATE_DIR / "invalid"  # --batch の結果のうちスキーマ違反で --repair 待ちのもの
+CACHE_MAX_AGE_DAYS = 30
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_RPM = 50         # レスポンスヘッダで実際の上限がわかるまでの初期値
+DEFAULT_TPM = 80000
+RETRY_MAX = 6
+BACKOFF_BASE = 2.0       # 秒
+BACKOFF_MAX = 60.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504, 529}
+AUTH_STATUS = {401, 403}
+KEY_COOLDOWN = 300.0     # 認証エラーを返したキーをローテーションから外す秒数
+METRICS_FILE = BASE_DIR / "metrics" / "generation.jsonl"
+RUN_ID = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+# USD / 100万トークン（input, output, cache write, cache read）。Batches API はこの半額。
+PRICING = {
+    "claude-sonnet-4-5-20250514": (3.00, 15.00, 3.75, 0.30),
+    "claude-haiku-4-5-20251001": (1.00, 5.00, 1.25, 0.10),
+    "claude-opus-4-1-20250805": (15.00, 75.00, 18.75, 1.50),
+}
+TOTAL_DAYS = 30
+DEFAULT_AHEAD = 3        # --start-date: 今日から何日先まで用意しておくか
+BATCH_POLL_INITIAL = 5.0  # 秒
+BATCH_POLL_MAX = 120.0
+
 # ── Month 1 メニュー定義（AUスイーツ） ──
 MENU = {
     1: "Scones", 2: "Lamington", 3: "Pavlova", 4: "Anzac Biscuits",
@@ -46,120 +86,118 @@ EMOJI_MAP = {
 }
 
 
-def build_prompt(day: int, sweet: str) -> str:
-    """Claude API に送るプロンプトを構築する。"""
-    return f"""あなたは英語教材のコンテンツライターです。以下の仕様に従い、Day {day} のコンテンツを **JSON** で出力してください。
+# プロンプトのうち日によって変わらない部分（対象者・JSON構造・ルール）。
+# system ブロックに置いて prompt caching の対象にする。
+SYSTEM_PROMPT = """あなたは英語教材のコンテンツライターです。以下の仕様に従い、指定された Day のコンテンツを **JSON** で出力してください。
 
 ## 対象者
 - 日本人女性、オーストラリア・ケアンズでワーホリ中、カフェ勤務
 - 英語レベル: A2（英検3級〜準2級）
 - 興味: 陸上競技、フィギュアスケート、Snow Man、山田涼介
 
-## Day {day}: {sweet}
-
 ## 出力JSON構造（厳密に守ること）
 
 ```json
-{{
-  "day": {day},
-  "sweet": "{sweet}",
-  "recipe": {{
-    "title": "How to Make {sweet}",
+{
+  "day": <Day番号>,
+  "sweet": "<スイーツ名>",
+  "recipe": {
+    "title": "How to Make <スイーツ名>",
     "intro": "(1-2文の導入。A2レベルの簡単な英語)",
     "ingredients": "(材料リスト、カンマ区切りの文字列)",
     "steps": [
       "(各ステップ1文。重要動詞を**太字**にする。6ステップ程度)"
     ]
-  }},
+  },
   "recipe_vocab": [
-    {{"en": "英単語", "ja": "日本語訳"}}
+    {"en": "英単語", "ja": "日本語訳"}
   ],
-  "quiz1": {{
+  "quiz1": {
     "question_ja": "(レシピの内容に関する日本語の質問)",
     "options": ["選択肢1", "選択肢2", "選択肢3"],
     "correct_index": 0,
     "explanation_correct": "(正解時の解説。英文引用を含む)",
     "explanation_wrong": "(不正解時のヒント)"
-  }},
-  "review": {{
+  },
+  "review": {
     "cafe_name": "(オーストラリアのカフェ名を創作)",
     "location": "(ケアンズ周辺の地名)",
     "stars": 5,
     "text": "(カフェでその日のスイーツを食べた感想レビュー。5-7文。A2レベル)"
-  }},
+  },
   "review_vocab": [
-    {{"en": "英単語", "ja": "日本語訳"}}
+    {"en": "英単語", "ja": "日本語訳"}
   ],
-  "quiz2": {{
+  "quiz2": {
     "question_ja": "(レビューの内容に関する日本語の質問)",
     "options": ["選択肢1", "選択肢2", "選択肢3"],
     "correct_index": 0,
     "explanation_correct": "(正解時の解説)",
     "explanation_wrong": "(不正解時のヒント)"
-  }},
+  },
   "australia_tips": [
     "(オーストラリアでこのスイーツに関連する豆知識。日本語で3段落。各段落に英語フレーズを含める)"
   ],
-  "conversation": {{
+  "conversation": {
     "scene": "(カフェでの接客場面の説明。日本語)",
     "lines": [
-      {{"speaker": "You", "text": "(英語のセリフ)"}},
-      {{"speaker": "Customer", "text": "(英語のセリフ)"}}
+      {"speaker": "You", "text": "(英語のセリフ)"},
+      {"speaker": "Customer", "text": "(英語のセリフ)"}
     ]
-  }},
+  },
   "conversation_vocab": [
-    {{"en": "英単語", "ja": "日本語訳"}}
+    {"en": "英単語", "ja": "日本語訳"}
   ],
-  "quiz3": {{
+  "quiz3": {
     "question_ja": "(会話の内容に関する日本語の質問)",
     "options": ["選択肢1", "選択肢2", "選択肢3"],
     "correct_index": 0,
     "explanation_correct": "(正解時の解説)",
     "explanation_wrong": "(不正解時のヒント)"
-  }},
-  "listening": {{
-    "part_a": {{
+  },
+  "listening": {
+    "part_a": {
       "title_ja": "(Part Aのタイトル。日本語)",
       "full_text": "(穴埋め用の新しい文章。レシピ/レビューとは完全に別の内容。同じスイーツに関連するが別のシーン。6-8文)",
       "gaps": [
-        {{"before": "文の穴の前の部分", "answer": "正解の単語", "after": "文の穴の後の部分"}}
+        {"before": "文の穴の前の部分", "answer": "正解の単語", "after": "文の穴の後の部分"}
       ]
-    }},
-    "part_b": {{
+    },
+    "part_b": {
       "title_ja": "(Part Bのタイトル。日本語)",
       "full_text": "(内容理解クイズ用の新しい文章。これもレシピ/レビューとは別。8-10文)",
       "questions": [
-        {{
+        {
           "question_ja": "(日本語の質問)",
           "options": ["選択肢1", "選択肢2", "選択肢3"],
           "correct_index": 0,
           "explanation_correct": "(正解時の解説)",
           "explanation_wrong": "(不正解時のヒント)"
-        }}
+        }
       ]
-    }}
-  }},
-  "pronunciation": {{
+    }
+  },
+  "pronunciation": {
     "sentences": [
-      {{
+      {
         "text": "(その日の教材から抜き出した重要フレーズ。5つ)",
         "tip": "(発音のコツ。リンキング、ストレス等。日本語)"
-      }}
+      }
     ]
-  }},
-  "try_it": {{
+  },
+  "try_it": {
     "prompt_ja": "(ライティングのお題。日本語)",
     "example": "(英語の例文。2-3文)"
-  }},
-  "yamada_comments": {{
+  },
+  "yamada_comments": {
     "recipe": "(セクション1冒頭の山田涼介コメント。推しネタ絡め。日本語で2-3文)",
     "review": "(セクション3冒頭のコメント)",
     "conversation": "(セクション6冒頭のコメント)",
     "listening": "(セクション8冒頭のコメント。陸上やフィギュア等のネタを自然に絡める)",
     "pronunciation": "(セクション9冒頭のコメント)",
     "try_it": "(セクション10冒頭のコメント)"
-  }}
-}}
+  }
+}
 ```
 
 ## 重要なルール
@@ -175,81 +213,1877 @@ def build_prompt(day: int, sweet: str) -> str:
 10. **会話のcustomer名**は英語名（Emma, Jack, Lily等、毎日変える）。
 11. JSONのみ出力。マークダウンのコードブロックで囲まないこと。説明文も不要。"""
 
+# SYSTEM_PROMPT と同じ構造・ルールを型の略記で書いた短い版（--prompt compact）。
+# 例のJSONを丸ごと書かず、繰り返し出てくる単語/クイズの形は V / Q にまとめている。
+SYSTEM_PROMPT_COMPACT = """英語教材ライターとして、指定 Day の教材をJSONだけで出力する（コードブロック・説明文なし）。
+対象: ケアンズでワーホリ中の日本人女性（カフェ勤務、英語A2＝英検3級〜準2級）。興味: 陸上, フィギュア, Snow Man, 山田涼介。
 
-def generate_day(client, day: int) -> dict:
-    """1日分のコンテンツを生成する。"""
-    sweet = MENU[day]
-    prompt = build_prompt(day, sweet)
+## 構造（この順のキー。s=文字列 n=整数 [x]×N=N個の配列）
+V={en:s,ja:s}
+Q={question_ja:s 日本語, options:[s]×3 日本語, correct_index:n 0-2, explanation_correct:s 英文引用を含む, explanation_wrong:s ヒント}
+{day:n, sweet:s,
+ recipe:{title:"How to Make <sweet>", intro:s 1-2文, ingredients:s カンマ区切り, steps:[s]×6前後 各1文・重要動詞を**太字**},
+ recipe_vocab:[V]×7-9, quiz1:Q レシピについて,
+ review:{cafe_name:s 豪州風の創作名, location:s ケアンズ周辺, stars:n 1-5, text:s そのスイーツを食べた感想5-7文},
+ review_vocab:[V]×5-7, quiz2:Q レビューについて,
+ australia_tips:[s]×3 豪州での豆知識・日本語の段落・各段落に英語フレーズ,
+ conversation:{scene:s カフェ接客の場面・日本語, lines:[{speaker:"You"|"Customer", text:s 英語}]},
+ conversation_vocab:[V]×5-7, quiz3:Q 会話について,
+ listening:{part_a:{title_ja:s, full_text:s 6-8文, gaps:[{before:s, answer:s 1語, after:s}]×5},
+            part_b:{title_ja:s, full_text:s 8-10文, questions:[Q]×3}},
+ pronunciation:{sentences:[{text:s 当日の教材の重要フレーズ, tip:s 発音のコツ(リンキング・ストレス等)日本語}]×5},
+ try_it:{prompt_ja:s ライティングのお題, example:s 英語2-3文},
+ yamada_comments:{recipe,review,conversation,listening,pronunciation,try_it:s 各セクション冒頭のコメント・日本語2-3文}}
+
+## ルール
+- 英語はA2。易しい単語・短い文。
+- listening の full_text はレシピ/レビュー/会話と別シーンの新しい文章（同じスイーツ。友達との会話・注文・料理教室など）。
+- yamada_comments は山田涼介（Snow Man）のキャラで親しみやすい先輩口調。推しネタを自然に絡める。
+- 会話の客は毎日違う英語名（Emma, Jack, Lily…）。"""
+
+PROMPTS = {"full": SYSTEM_PROMPT, "compact": SYSTEM_PROMPT_COMPACT}
+
+
+def build_prompt(day: int, sweet: str) -> str:
+    """Claude API に送る日ごとのプロンプト（SYSTEM_PROMPT に続く短い部分）を構築する。"""
+    return f"""## Day {day}: {sweet}
+
+system の仕様どおりに Day {day} のJSONを出力してください。"day" は {day}、"sweet" は "{sweet}"、recipe.title は "How to Make {sweet}" とすること。"""
+
+
+def build_section_prompt(day: int, sweet: str, keys: list, data: dict, problems: dict = None) -> str:
+    """一部のセクションだけを生成してもらうプロンプト。
+
+    data は同じ日の他のセクション（整合性のための参考）。problems を渡すと作り直しの指示になる。
+    """
+    context = {key: value for key, value in data.items() if key not in keys and key != "emoji"}
+    wanted = ", ".join(f'"{key}"' for key in keys)
+    if problems:
+        issues = "\n".join(f"- {error}" for key in keys for error in problems.get(key, []))
+        heading = f"## Day {day}: {sweet}（セクションの作り直し）\n\n次のセクションが仕様を満たしていませんでした。\n{issues}"
+    else:
+        heading = f"## Day {day}: {sweet}（セクション単位の生成）"
+    prompt = f"""{heading}
+
+system の仕様どおりに、{wanted} のキーだけを（この順で）持つJSONオブジェクトを出力してください。
+他のセクションは出力しないこと。"""
+    if context:
+        prompt += f"""
+
+## 同じ日の他のセクション（参考。内容の整合性を保つこと）
+{json.dumps(context, ensure_ascii=False)}"""
+    return prompt
 
-    print(f"  Generating Day {day}: {sweet}...", end=" ", flush=True)
 
-    message = client.messages.create(
-        model="claude-sonnet-4-5-20250514",
-        max_tokens=8000,
-        messages=[{"role": "user", "content": prompt}],
-    )
+# 生成モードのオプション。コマンドライン引数から作って各関数に渡す。
+#   force:    レスポンスキャッシュを読まない
+#   split:    セクションごとに並列生成する
+#   tool_use: JSONをツール呼び出しの引数として受け取る（フェンス除去・パース失敗が起きない）
+#   record:   生のレスポンスを保存するディレクトリ（None なら保存しない）
+#   route:    セクションの種類ごとのモデル表（None なら振り分けない）
+#   hedge:    遅い呼び出しに複製を投げる Hedger（None ならヘッジしない）
+#   build:    生成した日のHTMLをすぐ書き出す docs のディレクトリ（None ならHTMLは作らない）
+#   prompt:   system プロンプトの版（PROMPTS のキー）
+DEFAULT_OPTS = {"force": False, "split": False, "tool_use": False, "record": None, "route": None,
+                "hedge": None, "build": None, "prompt": "full"}
 
-    text = message.content[0].text.strip()
+TOOL_NAME = "save_day"
+
+
+def tool_schema(keys: list) -> dict:
+    """keys のセクションだけを持つツール入力スキーマ（DAY_SCHEMA の部分集合）。"""
+    return object_of({key: DAY_SCHEMA["properties"][key] for key in keys})
+
+
+def make_params(prompt: str, keys: list = None, opts: dict = None,
+                model: str = MODEL, max_tokens: int = MAX_TOKENS) -> dict:
+    """messages.create に渡すリクエストパラメータ。keys は出力させるトップレベルのキー。"""
+    opts = opts or DEFAULT_OPTS
+    params = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": [
+            {"type": "text", "text": PROMPTS[opts.get("prompt", "full")], "cache_control": {"type": "ephemeral"}},
+        ],
+        "messages": [{"role": "user", "content": prompt}],
+    }
+    if opts.get("tool_use"):
+        params["tools"] = [{
+            "name": TOOL_NAME,
+            "description": "教材のJSONを保存する。system の出力JSON構造どおりの内容を input に入れる。",
+            "input_schema": tool_schema(keys or DAY_KEYS),
+        }]
+        params["tool_choice"] = {"type": "tool", "name": TOOL_NAME}
+    return params
+
+
+def request_params(day: int, sweet: str, opts: dict = None) -> dict:
+    """1日分を丸ごと生成するリクエストパラメータ。"""
+    return make_params(build_prompt(day, sweet), DAY_KEYS, opts)
+
+
+def response_text(message) -> str:
+    """レスポンスのJSON本文。ツール呼び出しならその引数をJSON文字列にする。"""
+    for block in message.content:
+        if block.type == "tool_use":
+            return json.dumps(block.input, ensure_ascii=False)
+    return "".join(block.text for block in message.content if block.type == "text")
+
+
+def usage_dict(usage) -> dict:
+    """SDK の usage オブジェクトを dict にする（キャッシュ系は無ければ0）。"""
+    return {
+        "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+    }
+
+
+def format_usage(usage: dict) -> str:
+    return (f"in={usage['input_tokens']} cache_read={usage['cache_read_input_tokens']} "
+            f"cache_write={usage['cache_creation_input_tokens']} out={usage['output_tokens']}")
+
+
+def parse_response_text(text: str) -> dict:
+    """レスポンス本文からJSONを取り出す。"""
+    text = text.strip()
     # Strip markdown code block if present
     if text.startswith("```"):
         text = text.split("\n", 1)[1]
         if text.endswith("```"):
             text = text[:-3]
+    return json.loads(text)
+
+
+# ── JSONスキーマと検証 ──
+# SYSTEM_PROMPT の「出力JSON構造」と「重要なルール」をそのまま書き起こしたもの。
+# JSON Schema のサブセット（type / properties / required / items / minItems / maxItems /
+# minimum / maximum / minLength）で書き、標準ライブラリだけで検証する。
+
+TEXT = {"type": "string", "minLength": 1}
+
+
+def array_of(items: dict, min_items: int, max_items: int = None) -> dict:
+    return {"type": "array", "items": items, "minItems": min_items, "maxItems": max_items or min_items}
+
+
+def object_of(properties: dict) -> dict:
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+def vocab_schema(min_items: int, max_items: int) -> dict:
+    return array_of(object_of({"en": TEXT, "ja": TEXT}), min_items, max_items)
+
+
+QUIZ_SCHEMA = object_of({
+    "question_ja": TEXT,
+    "options": array_of(TEXT, 3),
+    "correct_index": {"type": "integer", "minimum": 0, "maximum": 2},
+    "explanation_correct": TEXT,
+    "explanation_wrong": TEXT,
+})
+
+DAY_SCHEMA = object_of({
+    "day": {"type": "integer", "minimum": 1, "maximum": 30},
+    "sweet": TEXT,
+    "recipe": object_of({
+        "title": TEXT,
+        "intro": TEXT,
+        "ingredients": TEXT,
+        "steps": array_of(TEXT, 4, 10),
+    }),
+    "recipe_vocab": vocab_schema(7, 9),
+    "quiz1": QUIZ_SCHEMA,
+    "review": object_of({
+        "cafe_name": TEXT,
+        "location": TEXT,
+        "stars": {"type": "integer", "minimum": 1, "maximum": 5},
+        "text": TEXT,
+    }),
+    "review_vocab": vocab_schema(5, 7),
+    "quiz2": QUIZ_SCHEMA,
+    "australia_tips": array_of(TEXT, 3),
+    "conversation": object_of({
+        "scene": TEXT,
+        "lines": array_of(object_of({"speaker": TEXT, "text": TEXT}), 2, 20),
+    }),
+    "conversation_vocab": vocab_schema(5, 7),
+    "quiz3": QUIZ_SCHEMA,
+    "listening": object_of({
+        "part_a": object_of({
+            "title_ja": TEXT,
+            "full_text": TEXT,
+            "gaps": array_of(object_of({"before": {"type": "string"}, "answer": TEXT,
+                                        "after": {"type": "string"}}), 5),
+        }),
+        "part_b": object_of({
+            "title_ja": TEXT,
+            "full_text": TEXT,
+            "questions": array_of(QUIZ_SCHEMA, 3),
+        }),
+    }),
+    "pronunciation": object_of({
+        "sentences": array_of(object_of({"text": TEXT, "tip": TEXT}), 5),
+    }),
+    "try_it": object_of({"prompt_ja": TEXT, "example": TEXT}),
+    "yamada_comments": object_of({
+        key: TEXT for key in ["recipe", "review", "conversation", "listening", "pronunciation", "try_it"]
+    }),
+})
+
+DAY_KEYS = list(DAY_SCHEMA["properties"])
+JSON_TYPES = {"object": dict, "array": list, "string": str, "integer": int}
+
+
+def schema_errors(value, schema: dict, path: str = "") -> list:
+    """value がスキーマに合わない箇所を "path: 理由" のリストで返す。"""
+    where = path or "(root)"
+    expected = schema["type"]
+    if not isinstance(value, JSON_TYPES[expected]) or (expected == "integer" and isinstance(value, bool)):
+        return [f"{where}: expected {expected}, got {type(value).__name__}"]
+
+    errors = []
+    if expected == "object":
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{where}: missing {key!r}")
+        for key, sub in schema.get("properties", {}).items():
+            if key in value:
+                errors += schema_errors(value[key], sub, f"{path}.{key}" if path else key)
+    elif expected == "array":
+        low, high = schema.get("minItems", 0), schema.get("maxItems")
+        if len(value) < low or (high is not None and len(value) > high):
+            want = str(low) if low == high else f"{low}-{high}"
+            errors.append(f"{where}: expected {want} item(s), got {len(value)}")
+        for i, item in enumerate(value):
+            errors += schema_errors(item, schema["items"], f"{path}.{i}")
+    elif expected == "integer":
+        if value < schema.get("minimum", value) or value > schema.get("maximum", value):
+            errors.append(f"{where}: {value} out of range {schema['minimum']}-{schema['maximum']}")
+    elif expected == "string":
+        if len(value.strip()) < schema.get("minLength", 0):
+            errors.append(f"{where}: empty string")
+    return errors
+
+
+def validate_day(data) -> dict:
+    """1日分のJSONを検証し、{トップレベルのキー: [エラー, ...]} を返す。問題なければ空dict。"""
+    if not isinstance(data, dict):
+        return {"(root)": [f"expected object, got {type(data).__name__}"]}
+    problems = {}
+    for key in DAY_KEYS:
+        if key not in data:
+            problems[key] = [f"missing {key!r}"]
+            continue
+        errors = schema_errors(data[key], DAY_SCHEMA["properties"][key], key)
+        if errors:
+            problems[key] = errors
+    return problems
+
+
+# ── ストリーミング中の構造チェック ──
+# 出力が途中で仕様から外れたら、その時点でストリームを切ってやり直す。
+
+STREAM_RETRIES = 2
+
+
+class SchemaDivergence(Exception):
+    """ストリーミング中の出力が仕様から外れた。"""
+
+
+def expected_length(path: tuple):
+    """配列の要素数が決まっている場所なら、その数を返す。"""
+    if path and path[-1] == "options":
+        return 3
+    if path == ("listening", "part_a", "gaps"):
+        return 5
+    return None
+
+
+class StreamChecker:
+    """テキストの差分を受け取りながらJSONの構造を追いかけるインクリメンタルパーサ。
+
+    値そのものは組み立てず、オブジェクト/配列の入れ子・キー・要素数だけを見る。
+    """
+
+    def __init__(self, keys: list = DAY_KEYS):
+        self.keys = keys         # トップレベルに来るべきキー（この順で）
+        self.stack = []          # [{"type": "object"|"array", "key": str, "count": int, ...}]
+        self.started = False
+        self.complete = False
+        self.in_string = False
+        self.escape = False
+        self.string_is_key = False
+        self.key_buf = []
+        self.last_key_index = -1
+        self.seen_keys = []
+        self.chunks = []         # 受け取った差分（打ち切ったときの記録用）
+
+    def path(self) -> tuple:
+        """現在の位置（キー/インデックスの並び）。"""
+        parts = []
+        for frame in self.stack:
+            if frame["type"] == "object":
+                parts.append(frame["key"])
+            else:
+                parts.append(frame["count"] - 1)
+        return tuple(parts)
+
+    def feed(self, chunk: str):
+        self.chunks.append(chunk)
+        for ch in chunk:
+            if self.complete:
+                return
+            if not self.started:
+                # ```json などJSON前の余計な文字は読み飛ばす
+                if ch == "{":
+                    self.started = True
+                    self.stack.append({"type": "object", "key": None, "expect_key": True})
+                continue
+            if self.in_string:
+                self._feed_string(ch)
+            else:
+                self._feed_structure(ch)
+
+    def _feed_string(self, ch: str):
+        if self.escape:
+            self.escape = False
+        elif ch == "\\":
+            self.escape = True
+        elif ch == '"':
+            self.in_string = False
+            if self.string_is_key:
+                self._on_key("".join(self.key_buf))
+            return
+        if self.string_is_key:
+            self.key_buf.append(ch)
+
+    def _start_value(self):
+        top = self.stack[-1]
+        if top["type"] == "array" and top["pending"]:
+            top["count"] += 1
+            top["pending"] = False
+
+    def _feed_structure(self, ch: str):
+        top = self.stack[-1]
+        if ch in " \t\r\n":
+            return
+        if ch == '"':
+            self.in_string = True
+            self.string_is_key = top["type"] == "object" and top["expect_key"]
+            self.key_buf = []
+            if not self.string_is_key:
+                self._start_value()
+        elif ch in "{[":
+            self._start_value()
+            if ch == "{":
+                self.stack.append({"type": "object", "key": None, "expect_key": True})
+            else:
+                self.stack.append({"type": "array", "count": 0, "pending": True})
+        elif ch in "}]":
+            want = "object" if ch == "}" else "array"
+            if top["type"] != want:
+                raise SchemaDivergence(f"unexpected '{ch}' at {self.path()}")
+            self.stack.pop()
+            if want == "array":
+                self._on_array_end(top)
+            if not self.stack:
+                self._on_document_end()
+        elif ch == ":":
+            top["expect_key"] = False
+        elif ch == ",":
+            if top["type"] == "object":
+                top["expect_key"] = True
+            else:
+                top["pending"] = True
+        else:
+            self._start_value()  # 数値・true/false/null
+
+    def _on_key(self, key: str):
+        self.stack[-1]["key"] = key
+        if len(self.stack) != 1:
+            return
+        if key not in self.keys:
+            raise SchemaDivergence(f"unknown top-level key {key!r}")
+        index = self.keys.index(key)
+        if index <= self.last_key_index:
+            raise SchemaDivergence(f"top-level key {key!r} out of order")
+        self.last_key_index = index
+        self.seen_keys.append(key)
+
+    def _on_array_end(self, frame: dict):
+        path = self.path()
+        want = expected_length(path)
+        if want is not None and frame["count"] != want:
+            raise SchemaDivergence(f"{'.'.join(map(str, path))} has {frame['count']} item(s), expected {want}")
+
+    def _on_document_end(self):
+        self.complete = True
+        missing = [key for key in self.keys if key not in self.seen_keys]
+        if missing:
+            raise SchemaDivergence(f"missing top-level key(s): {', '.join(missing)}")
+
+
+# ── レート制限を意識したスケジューラ ──
+# RPM/TPM を token bucket で管理し、429/529 は Retry-After か指数バックオフで待って再送する。
+
+class TokenBucket:
+    """1分あたり limit 個まで補充されるバケツ。"""
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.available = limit
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.limit, self.available + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """amount 個取れるようになるまでの秒数。"""
+        self.refill()
+        amount = min(amount, self.limit)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60 / self.limit
+
+    def take(self, amount: float):
+        self.refill()
+        self.available -= amount
+
+    def update(self, limit=None, remaining=None):
+        """レスポンスヘッダの limit / remaining に合わせる。"""
+        self.refill()
+        if limit:
+            self.limit = float(limit)
+        if remaining is not None:
+            self.available = min(self.available, float(remaining))
+        self.available = min(self.available, self.limit)
+
+
+def estimate_tokens(params: dict) -> int:
+    """リクエスト1件が消費するトークン数のざっくりした見積もり（入力 + 出力上限の半分）。"""
+    prompt_chars = len(json.dumps(params.get("system", ""), ensure_ascii=False))
+    prompt_chars += len(json.dumps(params["messages"], ensure_ascii=False))
+    return prompt_chars // 2 + params["max_tokens"] // 2
+
+
+def estimated_usage(params: dict, text: str) -> dict:
+    """途中で打ち切った試行の usage の見積もり（最終 usage が届かないので、estimate_tokens と同じ目安で数える）。"""
+    return {"input_tokens": estimate_tokens(params) - params["max_tokens"] // 2, "output_tokens": len(text) // 2}
+
+
+def header_float(headers, name: str):
+    value = headers.get(name) if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """ジッタ付き指数バックオフ（full jitter）。"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class KeySlot:
+    """APIキー1本分の状態（クライアント・RPM/TPM のバケツ・休止期限・実行中の件数）。"""
+
+    def __init__(self, name: str, client, rpm: float = DEFAULT_RPM, tpm: float = DEFAULT_TPM,
+                 budget: bool = False):
+        self.name = name
+        self.client = client
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        # budget=True なら rpm / tpm はこのキーに割り当てた上限で、ヘッダの値がそれより大きくても超えない
+        self.budget = (rpm, tpm) if budget else None
+        self.paused_until = 0.0
+        self.auth_failed_until = 0.0
+        self.in_flight = 0
+
+    def wait_time(self, estimated: int) -> float:
+        return max(self.paused_until - time.monotonic(),
+                   self.requests.wait_time(1),
+                   self.tokens.wait_time(estimated))
+
+    def load(self) -> tuple:
+        """小さいほど空いている（実行中の件数 / RPM、同じならトークンの残りが多い方）。"""
+        return self.in_flight / self.requests.limit, -self.tokens.available / self.tokens.limit
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def parse_key_pool(spec: str, rpm: float, tpm: float) -> list:
+    """"key1,key2:20:40000" を [(key, rpm, tpm, budget), ...] にする。
+
+    キーごとの RPM/TPM を書いたらそれがそのキーの上限 (budget=True)。
+    省略したら rpm / tpm（--rpm / --tpm）を初期値にして、ヘッダの実際の上限に合わせる。
+    """
+    pool = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        key, *budget = item.split(":")
+        if len(budget) not in (0, 2):
+            raise ValueError(f"expected KEY or KEY:RPM:TPM, got {item[:8]}…")
+        pool.append((key, float(budget[0]), float(budget[1]), True) if budget else (key, rpm, tpm, False))
+    return pool
+
+
+class RequestScheduler:
+    """API呼び出しをレート制限内に収めるスケジューラ。
+
+    すべての呼び出しはここを通り、RPM/TPM の token bucket から枠を取ってから送信する。
+    上限値はレスポンスヘッダ (anthropic-ratelimit-*) を見て随時更新する。
+    キーが複数あれば (slots)、枠の空いているキーのうち一番空いているものに割り当てる。
+    429 や認証エラーを返したキーはしばらくローテーションから外す。
+    """
+
+    def __init__(self, client=None, rpm: float = DEFAULT_RPM, tpm: float = DEFAULT_TPM, slots: list = None):
+        self.slots = slots or [KeySlot("key1", client, rpm, tpm)]
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, estimated: int) -> KeySlot:
+        """どれかのキーの枠が空くまで待ってから取る。先に来たものから順に通す。"""
+        async with self.lock:
+            while True:
+                waits = [(slot.wait_time(estimated), slot) for slot in self.slots]
+                ready = [slot for wait, slot in waits if wait <= 0]
+                if ready:
+                    break
+                await asyncio.sleep(min(wait for wait, _ in waits))
+            slot = min(ready, key=KeySlot.load)
+            slot.requests.take(1)
+            slot.tokens.take(estimated)
+            slot.in_flight += 1
+            return slot
+
+    def observe(self, slot: KeySlot, headers):
+        """レスポンスヘッダから実際の上限と残量を取り込む。"""
+        request_limit = header_float(headers, "anthropic-ratelimit-requests-limit")
+        token_limit = header_float(headers, "anthropic-ratelimit-tokens-limit")
+        if slot.budget:
+            request_limit = min(request_limit or slot.budget[0], slot.budget[0])
+            token_limit = min(token_limit or slot.budget[1], slot.budget[1])
+        slot.requests.update(request_limit, header_float(headers, "anthropic-ratelimit-requests-remaining"))
+        slot.tokens.update(token_limit, header_float(headers, "anthropic-ratelimit-tokens-remaining"))
+
+    def settle(self, slot: KeySlot, estimated: int, usage):
+        """見積もりと実際の消費トークンの差をバケツに戻す（または追加で引く）。"""
+        actual = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+        slot.tokens.available = min(slot.tokens.limit, slot.tokens.available + estimated - actual)
+
+    def pause(self, seconds: float):
+        """529 (overloaded) はキーではなく API 全体の混雑なので全キーを止める。"""
+        for slot in self.slots:
+            slot.pause(seconds)
+
+    async def stream(self, params: dict, on_text, on_sent=None) -> tuple:
+        """ストリーミングで1件呼び出す。各テキスト差分で on_text を呼ぶ。(message, stats) を返す。
+
+        ツール呼び出しのレスポンスでは、引数JSONの差分 (input_json_delta) を同じように on_text へ流す。
+        stats は {"retries", "wait_s", "ttft_s", "latency_s", "key"}（成功した試行の送信時点から計測）。
+        on_text が投げた例外はそのまま呼び出し元へ伝わる（ストリームは閉じられる）。
+        on_sent があれば、試行ごとに枠を待ち始めるとき on_sent(None)、送ったとき on_sent(送信時刻) を呼ぶ。
+        """
+        estimated = estimate_tokens(params)
+        started = time.monotonic()
+        for attempt in range(RETRY_MAX + 1):
+            if on_sent is not None:
+                on_sent(None)
+            slot = await self.acquire(estimated)
+            sent = time.monotonic()
+            if on_sent is not None:
+                on_sent(sent)
+            first_token = None
+            try:
+                async with slot.client.messages.stream(**params) as stream:
+                    self.observe(slot, stream.response.headers)
+                    async for event in stream:
+                        if event.type != "content_block_delta":
+                            continue
+                        if event.delta.type == "text_delta":
+                            delta = event.delta.text
+                        elif event.delta.type == "input_json_delta":
+                            delta = event.delta.partial_json
+                        else:
+                            continue
+                        if first_token is None:
+                            first_token = time.monotonic()
+                        on_text(delta)
+                    message = await stream.get_final_message()
+            except anthropic.APIStatusError as e:
+                now = time.monotonic()
+                if (e.status_code in AUTH_STATUS and attempt < RETRY_MAX
+                        and any(other.auth_failed_until <= now for other in self.slots if other is not slot)):
+                    # このキーだけ外して、まだ使える他のキーで送り直す
+                    if slot.auth_failed_until <= now:
+                        print(f"  Key {slot.name}: HTTP {e.status_code}, out of rotation for {KEY_COOLDOWN:.0f}s",
+                              flush=True)
+                    slot.auth_failed_until = now + KEY_COOLDOWN
+                    slot.pause(KEY_COOLDOWN)
+                    continue
+                if e.status_code not in RETRYABLE_STATUS or attempt == RETRY_MAX:
+                    raise
+                self.observe(slot, e.response.headers)
+                retry_after = header_float(e.response.headers, "retry-after")
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                if e.status_code == 429:
+                    # そのキーだけ止める。他のキーに空きがあれば acquire がそちらへ回す
+                    slot.pause(delay)
+                elif e.status_code == 529:
+                    self.pause(delay)
+                else:
+                    await asyncio.sleep(delay)
+                continue
+            except anthropic.APIConnectionError:
+                if attempt == RETRY_MAX:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            finally:
+                slot.in_flight -= 1
+            self.settle(slot, estimated, message.usage)
+            done = time.monotonic()
+            return message, {
+                "retries": attempt,
+                "wait_s": round(sent - started, 3),
+                "ttft_s": round((first_token or done) - sent, 3),
+                "latency_s": round(done - sent, 3),
+                "key": slot.name,
+            }
+        raise RuntimeError("unreachable")
+
+
+# ── メトリクス ──
+# 1リクエストごとに metrics/generation.jsonl へ1行追記し、--report で集計する。
+
+def request_cost(record: dict) -> float:
+    """1リクエストの料金（USD）。キャッシュヒットは0。"""
+    if record.get("cached") or record.get("model") not in PRICING:
+        return 0.0
+    price_in, price_out, price_write, price_read = PRICING[record["model"]]
+    cost = (record.get("input_tokens", 0) * price_in
+            + record.get("output_tokens", 0) * price_out
+            + record.get("cache_creation_input_tokens", 0) * price_write
+            + record.get("cache_read_input_tokens", 0) * price_read) / 1_000_000
+    return cost * (0.5 if record.get("batch") else 1.0)
+
+
+def record_metrics(record: dict):
+    """メトリクスを1行追記する。"""
+    record = {"ts": now_iso(), "run_id": RUN_ID, **record}
+    record["cost_usd"] = round(request_cost(record), 6)
+    METRICS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(METRICS_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def percentile(values: list, pct: float):
+    """最近傍順位法のパーセンタイル。空なら None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))  # ceil
+    return ordered[int(rank) - 1]
+
+
+def format_seconds(value) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def print_report(path: Path = METRICS_FILE):
+    """メトリクスを run ごと・全体で集計して表示する。"""
+    if not path.exists():
+        print(f"No metrics yet ({path})")
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    def summarize(label: str, rows: list):
+        api = [r for r in rows if not r.get("cached")]
+        latency = [r["latency_s"] for r in api if r.get("latency_s") is not None]
+        ttft = [r["ttft_s"] for r in api if r.get("ttft_s") is not None]
+        days = {(r.get("run_id"), r["day"]) for r in rows if "day" in r}
+        out_tokens = sum(r.get("output_tokens", 0) for r in api)
+        in_tokens = sum(r.get("input_tokens", 0) + r.get("cache_creation_input_tokens", 0)
+                        + r.get("cache_read_input_tokens", 0) for r in api)
+        cost = sum(r.get("cost_usd", 0) for r in rows)
+        per_day = len(days) or 1
+        print(f"  {label:<17} {len(api):>4} {len(rows) - len(api):>6} {len(days):>4} "
+              f"{format_seconds(percentile(latency, 50)):>8} {format_seconds(percentile(latency, 95)):>8} "
+              f"{format_seconds(percentile(ttft, 50)):>8} {format_seconds(percentile(ttft, 95)):>8} "
+              f"{in_tokens // per_day:>9} {out_tokens // per_day:>9} "
+              f"{sum(r.get('retries', 0) for r in rows):>7} ${cost:>8.4f} ${cost / per_day:>7.4f}")
+
+    print(f"  {'run':<17} {'reqs':>4} {'cached':>6} {'days':>4} {'p50':>8} {'p95':>8} "
+          f"{'ttft50':>8} {'ttft95':>8} {'in/day':>9} {'out/day':>9} {'retries':>7} {'cost':>9} {'cost/day':>8}")
+    runs = {}
+    for record in records:
+        runs.setdefault(record.get("run_id", "?"), []).append(record)
+    for run_id, rows in runs.items():
+        summarize(run_id, rows)
+    summarize("ALL", records)
+
+    routed = [r for r in records if r.get("class") and not r.get("cached")]
+    if routed:
+        print()
+        print_class_report(routed)
+
+
+def print_class_report(records: list):
+    """--route のセクション種類ごとの集計。同じトークン数を MODEL で払った場合との差を「saved」に出す。
+
+    latency の saved は、同じ種類を MODEL で生成した記録があるときだけ出る（p50 の差）。
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault((record["class"], record["model"]), []).append(record)
+    print(f"  {'class':<16} {'model':<27} {'reqs':>4} {'p50':>8} {'p95':>8} {'saved p50':>9} "
+          f"{'out/req':>7} {'cost':>9} {'saved':>9}")
+    for (name, model), rows in sorted(groups.items()):
+        latency = [r["latency_s"] for r in rows if r.get("latency_s") is not None]
+        p50 = percentile(latency, 50)
+        baseline = [r["latency_s"] for r in groups.get((name, MODEL), []) if r.get("latency_s") is not None]
+        saved_latency = None
+        if model != MODEL and baseline and p50 is not None:
+            saved_latency = percentile(baseline, 50) - p50
+        cost = sum(r.get("cost_usd", 0) for r in rows)
+        saved = sum(request_cost({**r, "model": MODEL}) for r in rows) - cost
+        out_tokens = sum(r.get("output_tokens", 0) for r in rows)
+        print(f"  {name:<16} {model:<27} {len(rows):>4} {format_seconds(p50):>8} "
+              f"{format_seconds(percentile(latency, 95)):>8} {format_seconds(saved_latency):>9} "
+              f"{out_tokens // len(rows):>7} ${cost:>8.4f} ${saved:>8.4f}")
+
+
+# ── レスポンスキャッシュ ──
+# (model, max_tokens, プロンプト全体) が同じなら前回のレスポンスを再利用する。
+
+def cache_key(params: dict) -> str:
+    """リクエストパラメータのハッシュ。"""
+    raw = json.dumps(params, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_get(key: str):
+    """キャッシュ済みのレコードを返す。無ければ None。"""
+    path = CACHE_DIR / f"{key}.json"
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        entry = json.load(f)
+    path.touch()  # LRU 用に最終利用時刻を更新
+    return entry
+
+
+def prompt_variant(params: dict) -> str:
+    """params の system がどの版（PROMPTS のキー）か。"""
+    text = params["system"][0]["text"]
+    return next((name for name, prompt in PROMPTS.items() if prompt == text), "custom")
+
+
+def response_mode(params: dict) -> str:
+    """"tool_use"（ツール引数で受け取る）か "text"（本文のJSONをパースする）か。"""
+    return "tool_use" if "tools" in params else "text"
+
+
+def record_fixture(record_dir: Path, params: dict, keys: list, text: str, stop_reason: str,
+                   usage: dict, aborted: str = None):
+    """生のレスポンスを --record のディレクトリに保存する（bench.py parse の入力になる）。
+
+    パースできなかったものや途中で打ち切ったものも残す。同じ本文は1ファイルにまとまる。
+    """
+    mode = response_mode(params)
+    fixture = {
+        "mode": mode,
+        "prompt": prompt_variant(params),
+        "model": params["model"],
+        "keys": keys,
+        "text": text,
+        "stop_reason": stop_reason,
+        "usage": usage,
+        "aborted": aborted,
+    }
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    write_state(Path(record_dir) / f"{mode}-{digest}.json", fixture)
+
+
+def cache_put(key: str, params: dict, text: str, usage: dict, stop_reason: str) -> dict:
+    """レスポンス本文と usage をキャッシュに保存する。"""
+    entry = {
+        "key": key,
+        "model": params["model"],
+        "max_tokens": params["max_tokens"],
+        "mode": response_mode(params),
+        "text": text,
+        "usage": usage,
+        "stop_reason": stop_reason,
+        "created_at": now_iso(),
+    }
+    write_state(CACHE_DIR / f"{key}.json", entry)
+    return entry
+
+
+def prune_cache(max_age_days: float = CACHE_MAX_AGE_DAYS, max_bytes: int = CACHE_MAX_BYTES) -> int:
+    """古いレコードと、容量超過分を最終利用が古い順に削除する。削除件数を返す。"""
+    if not CACHE_DIR.exists():
+        return 0
+    entries = sorted(CACHE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    total = 0
+    for path in entries:
+        stat = path.stat()
+        total += stat.st_size
+        if stat.st_mtime < cutoff or total > max_bytes:
+            path.unlink()
+            removed += 1
+    return removed
+
+
+class ValidationFailed(Exception):
+    """作り直しても仕様を満たさなかった。"""
+
+    def __init__(self, problems: dict):
+        self.problems = problems
+        super().__init__("; ".join(error for errors in problems.values() for error in errors))
+
+
+REPAIR_ROUNDS = 2
+
+
+def merge_info(total: dict, info: dict):
+    """複数リクエスト分の info (usage / aborts / retries) を total に足し込む。"""
+    for name, value in info["usage"].items():
+        total["usage"][name] = total["usage"].get(name, 0) + value
+    total["cached"] = total["cached"] and info["cached"]
+    total["aborts"] = total.get("aborts", []) + info.get("aborts", [])
+    total["retries"] = total.get("retries", 0) + info.get("retries", 0)
+    total["continuations"] = total.get("continuations", 0) + info.get("continuations", 0)
+    total["hedged"] = total.get("hedged", 0) + info.get("hedged", 0)
+
+
+# ── max_tokens で止まったときの続き生成 ──
+
+CONTINUE_MAX = 2
+
+
+async def stream_with_continuation(scheduler, params: dict, checker: StreamChecker, on_sent=None) -> tuple:
+    """ストリーミングで取得し、max_tokens で止まったら続きを頼んでつなげる。
 
-    data = json.loads(text)
-    print("OK")
+    途中までの出力を assistant メッセージとして渡すと、その続きから生成される。
+    構造チェックは同じ checker に流し続けるので、つなぎ目をまたいでも途切れない。
+    ツール呼び出しは先頭埋めで続けられないので、切れたらそのまま返す（末尾の切り詰めで救う）。
+    text は受け取った差分をつなげたもの。(text, stop_reason, usage, stats) を返す。
+    on_sent は scheduler.stream にそのまま渡す（続きのリクエストでも呼ばれる）。
+    """
+    message, stats = await scheduler.stream(params, checker.feed, on_sent)
+    text = "".join(checker.chunks)
+    usage = usage_dict(message.usage)
+    stats["continuations"] = 0
+    while (message.stop_reason == "max_tokens" and "tools" not in params
+           and stats["continuations"] < CONTINUE_MAX):
+        stats["continuations"] += 1
+        # assistant の先頭埋めは末尾の空白を受け付けない
+        text = text.rstrip()
+        continued = {**params, "messages": params["messages"] + [{"role": "assistant", "content": text}]}
+        received = len(checker.chunks)
+        message, more = await scheduler.stream(continued, checker.feed, on_sent)
+        text += "".join(checker.chunks[received:])
+        for name, value in usage_dict(message.usage).items():
+            usage[name] += value
+        stats["retries"] += more["retries"]
+        stats["wait_s"] = round(stats["wait_s"] + more["wait_s"], 3)
+        stats["latency_s"] = round(stats["latency_s"] + more["latency_s"], 3)
+    return text, message.stop_reason, usage, stats
+
+
+def repair_truncated_json(text: str) -> str:
+    """途中で切れたJSONを、最後に完結している要素までで閉じてパースできる形にする。
+
+    開いているオブジェクト・配列を閉じてみて、だめなら直前の区切り(,)まで
+    さかのぼって閉じ直す。どうしても直らなければ元のテキストを返す（パースで失敗する）。
+    """
+    start = text.find("{")
+    if start < 0:
+        return text
+    body = text[start:]
+    stack = []
+    cuts = []  # (位置, その時点の stack) … 区切りの直前で切れば、そこまでは完結している
+    in_string = escape = False
+    for i, ch in enumerate(body):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+        elif ch == ",":
+            cuts.append((i, list(stack)))
+
+    def closers(opened: list) -> str:
+        return "".join("}" if c == "{" else "]" for c in reversed(opened))
+
+    # 文字列の途中で切れた値は採用しない（途中までの文が正しい値として残ってしまうため）
+    candidates = [] if in_string else [body + closers(stack)]
+    candidates += [body[:i] + closers(opened) for i, opened in reversed(cuts[-200:])]
+    for candidate in candidates:
+        try:
+            json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        return candidate
+    return text
+
+
+# ── ヘッジリクエスト ──
+# なかなか返ってこない呼び出しに複製を追加で投げ、先に正しいJSONを返した方を採用する。
+# 数件の詰まった呼び出しで決まっている p95 を削るためのもの。
+
+HEDGE_MIN_SAMPLES = 5    # しきい値を出すのに必要な観測数（これ未満ならヘッジしない）
+HEDGE_BUDGET_USD = 0.50  # 1回の実行で複製に使ってよい費用
+
+
+def parses(text: str, stop_reason: str) -> bool:
+    """request_json と同じ手順でパースできるか。"""
+    if stop_reason == "max_tokens":
+        text = repair_truncated_json(text)
+    try:
+        parse_response_text(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+class Hedger:
+    """遅れている呼び出しに複製を投げるかどうかを決め、競争させる。
+
+    しきい値は同じ (model, group) の TTFT / 所要時間の pct パーセンタイル。
+    metrics/generation.jsonl の記録と、この実行中に観測した値から出す。
+    複製の費用は投げる時点で多めに見積もって budget_usd から引き、使い切ったらもう投げない。
+    """
+
+    def __init__(self, pct: float, budget_usd: float, path: Path = METRICS_FILE):
+        self.pct = pct
+        self.budget_usd = budget_usd
+        self.spent_usd = 0.0
+        self.fired = 0
+        self.won = 0
+        self.samples = {}  # (model, group) → {"ttft": [...], "latency": [...]}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record.get("status") == "ok" and not record.get("cached") and not record.get("batch"):
+                        self.observe(record["model"], record.get("group"), record)
+
+    def observe(self, model: str, group: str, stats: dict):
+        samples = self.samples.setdefault((model, group), {"ttft": [], "latency": []})
+        for name in ("ttft", "latency"):
+            if stats.get(f"{name}_s") is not None:
+                samples[name].append(stats[f"{name}_s"])
+
+    def limits(self, model: str, group: str):
+        """(最初のトークンまでの上限秒, 完了までの上限秒)。観測が足りなければ None。"""
+        samples = self.samples.get((model, group))
+        if not samples or len(samples["latency"]) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(samples["ttft"], self.pct), percentile(samples["latency"], self.pct)
+
+    def reserve(self, params: dict) -> bool:
+        """複製1件分の費用を予算から取る。足りなければ False。"""
+        half = params["max_tokens"] // 2
+        cost = request_cost({"model": params["model"], "input_tokens": estimate_tokens(params) - half,
+                             "output_tokens": half})
+        if self.spent_usd + cost > self.budget_usd:
+            return False
+        self.spent_usd += cost
+        self.fired += 1
+        return True
+
+    async def race(self, scheduler, params: dict, checker: StreamChecker, group: str = None,
+                   on_lost=None) -> tuple:
+        """stream_with_continuation と同じ結果を返す。しきい値を超えたら複製を投げて競争させる。
+
+        先にパースできる結果を返した方を採用し、残った方はキャンセルする（ストリームが閉じる）。
+        どちらもだめなら、主リクエストの結果（または例外）をそのまま返す。
+        採用しなかった方は on_lost(usage, estimated) で知らせる。終わっていれば実際の usage、
+        途中で止めたなら受け取った分からの見積もり (estimated=True)。
+        """
+        limits = self.limits(params["model"], group)
+        # しきい値は送信時点から測った ttft_s / latency_s なので、こちらも送った時刻から数える
+        state = {"sent": None}
+        changed = asyncio.Event()
+
+        def on_sent(at):
+            state["sent"] = at
+            changed.set()
+
+        primary = asyncio.create_task(stream_with_continuation(scheduler, params, checker, on_sent))
+        tasks = [primary]
+        checkers = {primary: checker}
+        winner = primary
+
+        async def wait_primary(timeout):
+            """主リクエストが終わるか、送信状態が変わるか、timeout 秒たつまで待つ。"""
+            changed.clear()
+            waiter = asyncio.create_task(changed.wait())
+            try:
+                await asyncio.wait([primary, waiter], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+
+        try:
+            if limits is None:
+                return await primary
+            ttft_limit, latency_limit = limits
+            while not primary.done():
+                if state["sent"] is None:
+                    # RPM/TPM の枠待ち（429 の停止を含む）の間は遅くて当然なので数えない
+                    await wait_primary(None)
+                    continue
+                # 書き始めていれば完了の上限、まだなら最初のトークンの上限まで待つ
+                limit = latency_limit if checker.chunks else ttft_limit
+                remaining = state["sent"] + limit - time.monotonic()
+                if remaining <= 0:
+                    break
+                await wait_primary(remaining)
+            if primary.done() or not self.reserve(params):
+                return await primary
+            hedge_checker = StreamChecker(checker.keys)
+            hedge = asyncio.create_task(stream_with_continuation(scheduler, params, hedge_checker))
+            tasks.append(hedge)
+            checkers[hedge] = hedge_checker
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and parses(*task.result()[:2]):
+                        winner = task
+                        text, stop_reason, usage, stats = task.result()
+                        self.won += task is hedge
+                        return text, stop_reason, usage, {**stats, "hedged": 1, "hedge_won": int(task is hedge)}
+            return await primary
+        finally:
+            for task in tasks:
+                finished = task.done() and not task.cancelled() and task.exception() is None
+                task.cancel()
+                if task is not winner and on_lost is not None:
+                    if finished:
+                        on_lost(task.result()[2], False)
+                    else:
+                        on_lost(estimated_usage(params, "".join(checkers[task].chunks)), True)
+
+
+async def request_json(scheduler, params: dict, keys: list, opts: dict = None,
+                       tags: dict = None) -> tuple:
+    """1リクエスト分のJSONを取得する（キャッシュ → ストリーミング + 構造チェック）。(data, info) を返す。
+
+    info は {"usage", "cached", "aborts", "retries"}。opts["force"] ならキャッシュを読まずに必ずAPIを呼ぶ。
+    tags（day / group など）はメトリクスの1行にそのまま入る。
+    """
+    record = {**(tags or {}), "model": params["model"], "max_tokens": params["max_tokens"],
+              "prompt": prompt_variant(params)}
+    key = cache_key(params)
+    opts = opts or DEFAULT_OPTS
+    entry = None if opts["force"] else cache_get(key)
+    if entry is not None:
+        parse_started = time.monotonic()
+        data = parse_response_text(entry["text"])
+        record_metrics({**record, "status": "cached", "cached": True, **entry["usage"],
+                        "parse_s": round(time.monotonic() - parse_started, 4)})
+        return data, {"usage": entry["usage"], "cached": True}
+
+    def lost(usage: dict, estimated: bool):
+        # 競争に負けた複製（または主リクエスト）も費用はかかっているので1行残す
+        record_metrics({**record, "status": "hedge_lost", "cached": False, "mode": response_mode(params),
+                        **usage, "usage_estimated": estimated})
+
+    aborts = []
+    retries = 0
+    for attempt in range(STREAM_RETRIES + 1):
+        checker = StreamChecker(keys)
+        try:
+            if opts.get("hedge"):
+                text, stop_reason, usage, stats = await opts["hedge"].race(
+                    scheduler, params, checker, (tags or {}).get("group"), on_lost=lost)
+            else:
+                text, stop_reason, usage, stats = await stream_with_continuation(scheduler, params, checker)
+            retries += stats["retries"]
+        except SchemaDivergence as e:
+            # async with を抜けた時点でストリームは閉じられる
+            aborts.append(str(e))
+            if opts.get("record"):
+                record_fixture(opts["record"], params, keys, "".join(checker.chunks), None, {}, str(e))
+            # 打ち切った試行ごとに1行。最終 usage は届かないので受け取った分から見積もる
+            row = {**record, "status": "aborted", "cached": False, "mode": response_mode(params),
+                   **estimated_usage(params, "".join(checker.chunks)), "usage_estimated": True}
+            if attempt == STREAM_RETRIES:
+                record_metrics({**row, "status": "diverged", "retries": retries, "aborts": len(aborts)})
+                raise
+            record_metrics(row)
+            continue
+        break
+
+    if opts.get("record"):
+        record_fixture(opts["record"], params, keys, text, stop_reason, usage)
+    record.update({"cached": False, "mode": response_mode(params), **usage, **stats, "retries": retries,
+                   "aborts": len(aborts), "stop_reason": stop_reason})
+    parse_started = time.monotonic()
+    try:
+        data = parse_response_text(text)
+    except json.JSONDecodeError:
+        if stop_reason != "max_tokens":
+            record_metrics({**record, "status": "parse_error",
+                            "parse_s": round(time.monotonic() - parse_started, 4)})
+            raise
+        # 続きを頼んでも終わらなかった: 末尾を切り詰めて閉じる（欠けたセクションは後で作り直す）
+        text = repair_truncated_json(text)
+        data = parse_response_text(text)
+        record["truncation_repaired"] = True
+    record_metrics({**record, "status": "ok", "parse_s": round(time.monotonic() - parse_started, 4)})
+    if opts.get("hedge"):
+        opts["hedge"].observe(params["model"], record.get("group"), stats)
+    # パースできたものだけキャッシュする。切り詰めて直したものは欠けがあるので残さない
+    if not record.get("truncation_repaired"):
+        cache_put(key, params, text, usage, stop_reason)
+    return data, {"usage": usage, "cached": False, "aborts": aborts, "retries": retries,
+                  "continuations": stats["continuations"], "hedged": stats.get("hedged", 0)}
+
+
+async def repair_day(scheduler, day: int, data: dict, problems: dict, info: dict,
+                     opts: dict = None) -> dict:
+    """仕様を満たさないセクションだけを再リクエストして data にマージする。
+
+    全体(8000トークン)を作り直すより安い。info に usage と作り直したキーを足し込む。
+    """
+    sweet = MENU[day]
+    info.setdefault("repaired", [])
+    for _ in range(REPAIR_ROUNDS):
+        keys = [key for key in DAY_KEYS if key in problems]
+        params = make_params(build_section_prompt(day, sweet, keys, data, problems), keys, opts)
+        patch, patch_info = await request_json(scheduler, params, keys, opts,
+                                               tags={"day": day, "group": "repair"})
+        merge_info(info, patch_info)
+        # 打ち切りを直した応答はキーが欠けることがある。残りは次の周か ValidationFailed に任せる
+        data.update({key: patch[key] for key in keys if key in patch})
+        info["repaired"] += [key for key in keys if key in patch and key not in info["repaired"]]
+        problems = validate_day(data)
+        if not problems:
+            return data
+    raise ValidationFailed(problems)
+
+
+# セクション単位で並列生成するときのグループ。after のグループの結果を参考として渡す。
+# recipe が終わればそれ以外はすべて同時に走るので、1日の所要時間 ≒ recipe + 一番遅いグループ。
+SECTION_GROUPS = [
+    {"name": "recipe", "keys": ["recipe", "recipe_vocab", "quiz1"], "after": []},
+    {"name": "tips", "keys": ["australia_tips"], "after": []},
+    {"name": "review", "keys": ["review", "review_vocab", "quiz2"], "after": ["recipe"]},
+    {"name": "conversation", "keys": ["conversation", "conversation_vocab", "quiz3"], "after": ["recipe"]},
+    {"name": "listening", "keys": ["listening"], "after": ["recipe"]},
+    {"name": "pronunciation", "keys": ["pronunciation", "try_it"], "after": ["recipe"]},
+    {"name": "yamada", "keys": ["yamada_comments"], "after": ["recipe"]},
+]
+
+# --route: セクションの種類（class）ごとにモデルと max_tokens を振り分ける。
+# 単語リストや3択クイズのような定型部分は小さいモデルで十分なので、そちらに回して安く速くする。
+HAIKU = "claude-haiku-4-5-20251001"
+SECTION_ROUTES = {
+    "prose": {"model": MODEL, "max_tokens": 4000},
+    "vocab": {"model": HAIKU, "max_tokens": 2000},
+    "quizzes": {"model": HAIKU, "max_tokens": 1500},
+    "yamada_comments": {"model": HAIKU, "max_tokens": 1000},
+}
+
+# 本文(prose)を元に単語・クイズを作るので、それぞれ元のセクションだけを待つ。
+ROUTED_GROUPS = [
+    {"name": "recipe", "class": "prose", "keys": ["recipe"], "after": []},
+    {"name": "tips", "class": "prose", "keys": ["australia_tips"], "after": []},
+    {"name": "review", "class": "prose", "keys": ["review"], "after": ["recipe"]},
+    {"name": "conversation", "class": "prose", "keys": ["conversation"], "after": ["recipe"]},
+    {"name": "listening", "class": "prose", "keys": ["listening"], "after": ["recipe"]},
+    {"name": "pronunciation", "class": "prose", "keys": ["pronunciation", "try_it"], "after": ["recipe"]},
+    {"name": "recipe_vocab", "class": "vocab", "keys": ["recipe_vocab"], "after": ["recipe"]},
+    {"name": "review_vocab", "class": "vocab", "keys": ["review_vocab"], "after": ["review"]},
+    {"name": "conversation_vocab", "class": "vocab", "keys": ["conversation_vocab"], "after": ["conversation"]},
+    {"name": "quiz1", "class": "quizzes", "keys": ["quiz1"], "after": ["recipe"]},
+    {"name": "quiz2", "class": "quizzes", "keys": ["quiz2"], "after": ["review"]},
+    {"name": "quiz3", "class": "quizzes", "keys": ["quiz3"], "after": ["conversation"]},
+    {"name": "yamada", "class": "yamada_comments", "keys": ["yamada_comments"], "after": ["recipe"]},
+]
+
+
+def routed_groups(routes: dict) -> list:
+    """ROUTED_GROUPS に routes（class → {"model", "max_tokens"}）のモデルを割り当てる。"""
+    return [{**group, **SECTION_ROUTES[group["class"]], **routes.get(group["class"], {})}
+            for group in ROUTED_GROUPS]
+
+
+def load_routes(path: Path) -> dict:
+    """--routes のJSON（class → {"model", "max_tokens"}）を読む。"""
+    with open(path, "r", encoding="utf-8") as f:
+        routes = json.load(f)
+    unknown = set(routes) - set(SECTION_ROUTES)
+    if unknown:
+        raise ValueError(f"unknown section class: {', '.join(sorted(unknown))} "
+                         f"(expected {', '.join(SECTION_ROUTES)})")
+    return routes
+
+
+async def generate_sections(scheduler, day: int, groups: list, opts: dict = None) -> tuple:
+    """グループごとのリクエストを並列に投げ、1日分のJSONに組み立てる。(data, info) を返す。
+
+    失敗したグループがあれば例外になるが、成功したグループはキャッシュに残るので再実行は安い。
+    """
+    sweet = MENU[day]
+    data = {"day": day, "sweet": sweet}
+    info = {"usage": {}, "cached": True}
+    tasks = {}
+
+    async def run_group(group: dict) -> dict:
+        context = {}
+        for name in group["after"]:
+            context.update(await tasks[name])
+        prompt = build_section_prompt(day, sweet, group["keys"], context)
+        params = make_params(prompt, group["keys"], opts,
+                             group.get("model", MODEL), group.get("max_tokens", MAX_TOKENS))
+        tags = {"day": day, "group": group["name"]}
+        if "class" in group:
+            tags["class"] = group["class"]
+        part, part_info = await request_json(scheduler, params, group["keys"], opts, tags=tags)
+        merge_info(info, part_info)
+        return {key: part[key] for key in group["keys"] if key in part}
+
+    # after で参照するグループは必ず先に並んでいるので、順にタスクを作れば依存を待てる
+    for group in groups:
+        tasks[group["name"]] = asyncio.create_task(run_group(group))
+    try:
+        parts = await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    for part in parts:
+        data.update(part)
+    return {key: data[key] for key in DAY_KEYS if key in data}, info
+
+
+async def generate_day(scheduler, day: int, opts: dict = None) -> tuple:
+    """1日分のコンテンツを生成する。(data, info) を返す。
+
+    opts["split"] ならセクションごとに並列生成して組み立てる。
+    opts["route"]（class → モデルの表）があれば、セクションの種類ごとにモデルを振り分けて並列生成する。
+    仕様を満たさないセクションがあれば、そのセクションだけ作り直してマージする。
+    """
+    opts = opts or DEFAULT_OPTS
+    if opts["route"] is not None:
+        data, info = await generate_sections(scheduler, day, routed_groups(opts["route"]), opts)
+    elif opts["split"]:
+        data, info = await generate_sections(scheduler, day, SECTION_GROUPS, opts)
+    else:
+        data, info = await request_json(scheduler, request_params(day, MENU[day], opts), DAY_KEYS,
+                                        opts, tags={"day": day, "group": "full"})
+    problems = validate_day(data)
+    if problems:
+        data = await repair_day(scheduler, day, data, problems, info, opts)
+    return data, info
+
+
+def add_emoji(day: int, data: dict) -> dict:
+    data["emoji"] = EMOJI_MAP.get(MENU[day], "🍰")
     return data
 
 
+def save_day(output_dir: Path, day: int, data: dict) -> Path:
+    """生成結果を content/dayN.json に保存する。"""
+    add_emoji(day, data)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    out_path = output_dir / f"day{day}.json"
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    if output_dir != INVALID_DIR:
+        # 正常な版を書いたので、保留していた不正な版はもう要らない
+        (INVALID_DIR / f"day{day}.json").unlink(missing_ok=True)
+    return out_path
+
+
+def day_path(output_dir: Path, day: int) -> Path:
+    """検証・修復の対象にする Day N のJSON。--batch で保留した不正な版があればそちら。"""
+    pending = INVALID_DIR / f"day{day}.json"
+    return pending if pending.exists() else output_dir / f"day{day}.json"
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def load_state(path: Path) -> dict:
+    """.state/ 以下のJSONを読む。無ければ空dict。"""
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_state(path: Path, data: dict):
+    """一時ファイル経由でアトミックに書き込む。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def prompt_fingerprint(day: int, opts: dict = None) -> str:
+    """その日のリクエスト内容のハッシュ（プロンプトやモデルが変わると変わる）。
+
+    --split / --route では、グループごとのリクエストの雛形（前段の出力を空にしたもの）と
+    振り分け後のモデル・max_tokens を含めるので、モードや --routes の表を変えても変わる。
+    """
+    opts = opts or DEFAULT_OPTS
+    if opts["route"] is not None:
+        mode, groups = "route", routed_groups(opts["route"])
+    elif opts["split"]:
+        mode, groups = "split", SECTION_GROUPS
+    else:
+        return cache_key(request_params(day, MENU[day], opts))
+    requests = [[group["name"], cache_key(make_params(build_section_prompt(day, MENU[day], group["keys"], {}),
+                                                      group["keys"], opts, group.get("model", MODEL),
+                                                      group.get("max_tokens", MAX_TOKENS)))]
+                for group in groups]
+    return hashlib.sha256(json.dumps([mode, requests]).encode("utf-8")).hexdigest()
+
+
+def record_day(manifest: dict, day: int, **fields):
+    """実行マニフェストの Day N を更新し、すぐにディスクへ書き出す。"""
+    entry = manifest.setdefault("days", {}).setdefault(str(day), {"attempts": 0})
+    entry.update(fields)
+    manifest["updated_at"] = now_iso()
+    write_state(RUN_MANIFEST, manifest)
+
+
+def start_day(manifest: dict, day: int, opts: dict = None):
+    """Day N の試行開始を記録する（attempts を1増やす）。"""
+    attempts = manifest.get("days", {}).get(str(day), {}).get("attempts", 0) + 1
+    record_day(manifest, day, status="running", attempts=attempts,
+               prompt_hash=prompt_fingerprint(day, opts), started_at=now_iso())
+
+
+def is_up_to_date(manifest: dict, output_dir: Path, day: int, opts: dict = None) -> bool:
+    """JSONが存在し、前回成功時と同じプロンプトで生成されたものなら True。"""
+    entry = manifest.get("days", {}).get(str(day))
+    out_path = output_dir / f"day{day}.json"
+    if not entry or entry.get("status") != "done" or not out_path.exists():
+        return False
+    return (entry.get("prompt_hash") == prompt_fingerprint(day, opts)
+            and entry.get("output_hash") == file_hash(out_path))
+
+
+def build_page(docs_dir: Path, data: dict) -> Path:
+    """dayN.html を書き、docs_dir にあるページで index.html を作り直す。
+
+    minify の有無は前回の build_html.py の設定に合わせる（混ざると参照する共通CSS/JSが食い違う）。
+    """
+    minify = build_html.saved_minify()
+    path = build_html.write_day_html(data, docs_dir, minify)
+    available = [d for d in range(1, build_html.TOTAL_DAYS + 1) if (docs_dir / f"day{d}.html").exists()]
+    build_html.write_index(available, docs_dir, minify)
+    return path
+
+
+def build_valid_page(docs_dir: Path, day: int, data: dict, problems: dict = None):
+    """仕様を満たす日だけ dayN.html を書く（--batch 用）。
+
+    欠けたセクションがあると描画で落ちるので、validate_day で問題があれば書かずに知らせる。
+    描画の失敗もここで止めて、結果の保存を続けられるようにする。
+    """
+    problems = validate_day(data) if problems is None else problems
+    if problems:
+        print(f"  Not built: Day {day} - invalid ({', '.join(problems)})")
+        return
+    try:
+        print(f"  Built: {build_page(docs_dir, data)}")
+    except Exception as e:
+        print(f"  ERROR (build): Day {day} - {e}")
+
+
+async def build_pages(pages: asyncio.Queue, docs_dir: Path, started: float) -> list:
+    """キューに届いた日から順に dayN.html を書き、index.html も更新する。None が来たら終わる。
+
+    JSONを読み直さず、生成したdictをそのまま build_html に渡す。書いた日のリストを返す。
+    """
+    await asyncio.to_thread(build_html.copy_assets, docs_dir, build_html.saved_minify())
+    built = []
+    while True:
+        item = await pages.get()
+        if item is None:
+            await asyncio.to_thread(build_html.prune_assets, docs_dir)
+            return built
+        day, data = item
+        try:
+            path = await asyncio.to_thread(build_page, docs_dir, data)
+        except Exception as e:
+            print(f"  ERROR (build): Day {day} - {e}", flush=True)
+            continue
+        built.append(day)
+        print(f"  Built: {path} (+{time.monotonic() - started:.1f}s)", flush=True)
+
+
+async def run_days(scheduler, days: list, output_dir: Path, concurrency: int,
+                   opts: dict = None):
+    """最大 concurrency 件を同時に投げて生成する。ログは Day 順に出す。
+
+    opts["build"]（docs のディレクトリ）があれば、できた日からすぐHTMLまで作る。
+    JSONの保存はその裏で行う。
+    """
+    opts = opts or DEFAULT_OPTS
+    semaphore = asyncio.Semaphore(concurrency)
+    manifest = load_state(RUN_MANIFEST)
+    pages = asyncio.Queue()
+    builder = None
+    if opts.get("build"):
+        builder = asyncio.create_task(build_pages(pages, opts["build"], time.monotonic()))
+
+    async def worker(day: int) -> list:
+        sweet = MENU[day]
+        async with semaphore:
+            start_day(manifest, day, opts)
+            started = time.monotonic()
+            try:
+                data, info = await generate_day(scheduler, day, opts)
+            except json.JSONDecodeError as e:
+                record_day(manifest, day, status="error", error=f"JSON parse: {e}",
+                           duration_s=round(time.monotonic() - started, 2))
+                return [f"  ERROR (JSON parse): Day {day} - {e}"]
+            except (SchemaDivergence, ValidationFailed) as e:
+                record_day(manifest, day, status="error", error=f"schema: {e}",
+                           duration_s=round(time.monotonic() - started, 2))
+                return [f"  ERROR (schema): Day {day} - {e}"]
+            except Exception as e:
+                record_day(manifest, day, status="error", error=str(e),
+                           duration_s=round(time.monotonic() - started, 2))
+                return [f"  ERROR: Day {day} - {e}"]
+        # 保存は完了した順にすぐ行う（--build ならHTMLを先に作り始め、JSONの書き込みは別スレッドで）
+        if builder:
+            pages.put_nowait((day, add_emoji(day, data)))
+        out_path = await asyncio.to_thread(save_day, output_dir, day, data)
+        record_day(manifest, day, status="done", error=None, output_hash=file_hash(out_path),
+                   finished_at=now_iso(), duration_s=round(time.monotonic() - started, 2))
+        status = "cached" if info["cached"] else format_usage(info["usage"])
+        if info.get("retries"):
+            status += f" retries={info['retries']}"
+        if info.get("continuations"):
+            status += f" continued={info['continuations']}"
+        if info.get("hedged"):
+            status += f" hedged={info['hedged']}"
+        notes = [f"  Aborted stream: Day {day} - {reason}" for reason in info.get("aborts", [])]
+        if info.get("repaired"):
+            notes.append(f"  Repaired: Day {day} - {', '.join(info['repaired'])}")
+        return notes + [f"  Day {day}: {sweet}... OK ({status})", f"  Saved: {out_path}"]
+
+    tasks = [asyncio.create_task(worker(day)) for day in days[:1]]
+    if concurrency > 1 and tasks:
+        # 1件目で system プロンプトのキャッシュを作ってから残りを並列に投げる
+        await asyncio.wait(tasks)
+    tasks += [asyncio.create_task(worker(day)) for day in days[1:]]
+    for task in tasks:
+        for line in await task:
+            print(line, flush=True)
+    if builder:
+        pages.put_nowait(None)
+        built = await builder
+        print(f"  Built {len(built)} page(s) in {opts['build']}")
+    hedger = opts.get("hedge")
+    if hedger and hedger.fired:
+        print(f"  Hedged {hedger.fired} request(s), {hedger.won} won by the duplicate "
+              f"(extra spend ≤ ${hedger.spent_usd:.4f} of ${hedger.budget_usd:.2f})")
+
+
+# ── 期日順のスケジュール生成 ──
+# Day N は開始日の N-1 日後に開く。今日から ahead 日先までを常に用意しておき、
+# 欠けている日（JSONが無い・壊れている・前回失敗した）だけを期日の早い順に生成する。
+# 何度実行しても埋まっている日は作り直さないので cron から毎日呼べる。
+
+def due_date(start: date, day: int) -> date:
+    return start + timedelta(days=day - 1)
+
+
+def is_ready(manifest: dict, output_dir: Path, day: int) -> bool:
+    """Day N のJSONがあり、スキーマを満たし、前回の生成が失敗していないか。"""
+    path = output_dir / f"day{day}.json"
+    if not path.exists():
+        return False
+    if manifest.get("days", {}).get(str(day), {}).get("status") in ("error", "invalid"):
+        return False
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return not validate_day(json.load(f))
+    except json.JSONDecodeError:
+        return False
+
+
+def plan_days(start: date, today: date, ahead: int, output_dir: Path) -> list:
+    """期日が today + ahead 日までの日のうち、まだ用意できていない日を期日順に返す。"""
+    last = min(TOTAL_DAYS, (today - start).days + 1 + ahead)
+    manifest = load_state(RUN_MANIFEST)
+    return [day for day in range(1, last + 1) if not is_ready(manifest, output_dir, day)]
+
+
+def check_days(days: list, output_dir: Path) -> dict:
+    """既存のJSONを検証して結果を表示する。{day: problems} を返す（問題のある日のみ）。"""
+    broken = {}
+    for day in days:
+        path = day_path(output_dir, day)
+        if path.parent == INVALID_DIR:
+            print(f"  Day {day}: checking pending batch result {path}")
+        if not path.exists():
+            print(f"  Day {day}: no JSON")
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                print(f"  Day {day}: JSON parse error - {e}")
+                continue
+        problems = validate_day(data)
+        if not problems:
+            print(f"  Day {day}: OK")
+            continue
+        broken[day] = problems
+        for errors in problems.values():
+            for error in errors:
+                print(f"  Day {day}: {error}")
+    return broken
+
+
+async def run_repair(scheduler, broken: dict, output_dir: Path, opts: dict = None):
+    """壊れたセクションだけを作り直して上書き保存する。"""
+    for day, problems in broken.items():
+        path = day_path(output_dir, day)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        info = {"usage": {}, "cached": True}
+        try:
+            data = await repair_day(scheduler, day, data, problems, info, opts)
+        except (SchemaDivergence, ValidationFailed) as e:
+            print(f"  ERROR (schema): Day {day} - {e}")
+            continue
+        out_path = save_day(output_dir, day, data)
+        print(f"  Repaired: Day {day} - {', '.join(info['repaired'])} → {out_path}")
+
+
+def save_batch_day(output_dir: Path, day: int, data: dict, opts: dict, run_manifest: dict,
+                   prompt_hash: str) -> tuple:
+    """バッチの結果を保存して manifest に記録する。(保存先, problems) を返す。
+
+    バッチでは作り直せないので、スキーマ違反の日は content/ の版を上書きせず .state/invalid/ に置く。
+    --repair で直すと content/ に書かれる。
+    """
+    problems = validate_day(data)
+    out_path = save_day(INVALID_DIR if problems else output_dir, day, data)
+    if opts.get("build"):
+        build_valid_page(opts["build"], day, data, problems)
+    record_day(run_manifest, day, status="invalid" if problems else "done",
+               error="; ".join(problems) if problems else None,
+               prompt_hash=prompt_hash, output_hash=file_hash(out_path), finished_at=now_iso())
+    return out_path, problems
+
+
+async def run_batch(client, days: list, output_dir: Path, opts: dict = None):
+    """Message Batches API で一括生成する。中断しても .state/batch.json から再開できる。"""
+    opts = opts or DEFAULT_OPTS
+    manifest = load_state(BATCH_MANIFEST)
+    run_manifest = load_state(RUN_MANIFEST)
+    if opts.get("build"):
+        build_html.copy_assets(opts["build"], build_html.saved_minify())
+    if manifest and manifest.get("status") != "done":
+        batch_id = manifest["batch_id"]
+        output_dir = Path(manifest["output_dir"])
+        # 送信したときのモードで結果を読む
+        opts = {**opts, "tool_use": manifest.get("tool_use", False), "prompt": manifest.get("prompt", "full")}
+        print(f"Resuming batch {batch_id} (Day {', '.join(map(str, manifest['days']))})")
+    else:
+        # キャッシュにある日はバッチに入れずそのまま保存する
+        pending = []
+        for day in days:
+            entry = None if opts["force"] else cache_get(cache_key(request_params(day, MENU[day], opts)))
+            if entry is None:
+                pending.append(day)
+                continue
+            data = parse_response_text(entry["text"])
+            out_path, problems = save_batch_day(output_dir, day, data, opts, run_manifest,
+                                                prompt_fingerprint(day, opts))
+            print(f"  Saved: {out_path} (cached)")
+            if problems:
+                print(f"  INVALID: Day {day} - {', '.join(problems)} (python generate_content.py --day {day} --repair)")
+        if not pending:
+            return
+        days = pending
+        batch = await client.messages.batches.create(requests=[
+            {"custom_id": f"day{day}", "params": request_params(day, MENU[day], opts)}
+            for day in days
+        ])
+        for day in days:
+            start_day(run_manifest, day, opts)
+        batch_id = batch.id
+        manifest = {
+            "batch_id": batch_id,
+            "status": "in_progress",
+            "days": days,
+            "output_dir": str(output_dir),
+            "tool_use": opts["tool_use"],
+            "prompt": opts["prompt"],
+            "saved": [],
+            "created_at": now_iso(),
+        }
+        write_state(BATCH_MANIFEST, manifest)
+        print(f"Submitted batch {batch_id} ({len(days)} request(s))")
+
+    # 終わるまでバックオフしながらポーリング
+    delay = BATCH_POLL_INITIAL
+    started = time.monotonic()
+    while True:
+        batch = await client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        print(f"  [{time.monotonic() - started:6.0f}s] {batch.processing_status}: "
+              f"processing={counts.processing} succeeded={counts.succeeded} "
+              f"errored={counts.errored} expired={counts.expired}", flush=True)
+        if batch.processing_status == "ended":
+            break
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BATCH_POLL_MAX)
+
+    # 結果は1件ずつ届いた順に保存し、その都度マニフェストも更新する
+    saved = set(manifest["saved"])
+    async for entry in await client.messages.batches.results(batch_id):
+        day = int(entry.custom_id.removeprefix("day"))
+        if day in saved:
+            continue
+        result = entry.result
+        if result.type != "succeeded":
+            record_day(run_manifest, day, status="error", error=f"batch result {result.type}")
+            print(f"  ERROR: Day {day} - batch result {result.type}")
+            continue
+        message = result.message
+        text = response_text(message)
+        params = request_params(day, MENU[day], opts)
+        usage = usage_dict(message.usage)
+        if opts.get("record"):
+            record_fixture(opts["record"], params, DAY_KEYS, text, message.stop_reason, usage)
+        repaired = message.stop_reason == "max_tokens"
+        try:
+            if repaired:
+                # バッチでは続きを頼めないので、閉じられるところで閉じる（欠けは --repair で補う）
+                text = repair_truncated_json(text)
+            data = parse_response_text(text)
+        except json.JSONDecodeError as e:
+            record_day(run_manifest, day, status="error", error=f"JSON parse: {e}")
+            print(f"  ERROR (JSON parse): Day {day} - {e}")
+            continue
+        record_metrics({"day": day, "group": "full", "model": params["model"], "batch": True,
+                        "mode": response_mode(params), "status": "ok", "cached": False, **usage, "stop_reason": message.stop_reason})
+        if not repaired:
+            cache_put(cache_key(params), params, text, usage, message.stop_reason)
+        out_path, problems = save_batch_day(output_dir, day, data, opts, run_manifest, cache_key(params))
+        print(f"  Saved: {out_path} ({format_usage(usage)})", flush=True)
+        if problems:
+            print(f"  INVALID: Day {day} - {', '.join(problems)} (python generate_content.py --day {day} --repair)")
+        saved.add(day)
+        manifest["saved"] = sorted(saved)
+        write_state(BATCH_MANIFEST, manifest)
+
+    manifest["status"] = "done"
+    manifest["finished_at"] = now_iso()
+    write_state(BATCH_MANIFEST, manifest)
+    if opts.get("build"):
+        build_html.prune_assets(opts["build"])
+    missing = [day for day in manifest["days"] if day not in saved]
+    if missing:
+        print(f"  Not saved: Day {', '.join(map(str, missing))}")
+
+
 def main():
     parser = argparse.ArgumentParser(description="30日分のコンテンツJSON生成")
     parser.add_argument("--day", type=int, help="特定の日だけ生成 (1-30)")
     parser.add_argument("--all", action="store_true", help="30日分すべて生成")
     parser.add_argument("--range", type=str, help="範囲指定 (例: 1-5)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="同時リクエスト数 (デフォルト: 1)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Message Batches API でまとめて生成 (中断したバッチは再実行で再開)")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM,
+                        help=f"1分あたりのリクエスト数の初期上限 (デフォルト: {DEFAULT_RPM}、以後はレスポンスヘッダに追従)")
+    parser.add_argument("--tpm", type=float, default=DEFAULT_TPM,
+                        help=f"1分あたりのトークン数の初期上限 (デフォルト: {DEFAULT_TPM})")
+    parser.add_argument("--split", action="store_true",
+                        help="セクションごとに並列リクエストして1日分に組み立てる")
+    parser.add_argument("--tool-use", action="store_true",
+                        help="JSONをツール呼び出しの引数として受け取る（入力スキーマで構造を強制）")
+    parser.add_argument("--record", type=Path, metavar="DIR",
+                        help="生のレスポンスを DIR に保存する（python bench.py parse DIR で比較）")
+    parser.add_argument("--route", action="store_true",
+                        help="セクションの種類 (prose/vocab/quizzes/yamada_comments) ごとにモデルを振り分けて並列生成")
+    parser.add_argument("--routes", type=Path, metavar="FILE",
+                        help="--route のモデル表を上書きするJSON (例: {\"vocab\": {\"model\": \"...\", \"max_tokens\": 2000}})")
+    parser.add_argument("--hedge", type=float, metavar="PCT",
+                        help="TTFT / 所要時間がこれまでの PCT パーセンタイルを超えた呼び出しに複製を投げる (例: 95)")
+    parser.add_argument("--hedge-budget", type=float, default=HEDGE_BUDGET_USD, metavar="USD",
+                        help=f"複製に使ってよい費用の上限 (デフォルト: ${HEDGE_BUDGET_USD})")
+    parser.add_argument("--build", action="store_true",
+                        help="生成できた日からすぐ docs/ にHTMLを書き出す（build_html.py を別に走らせなくてよい）")
+    parser.add_argument("--docs-dir", type=Path, default=build_html.DOCS_DIR,
+                        help="--build の出力先 (デフォルト: docs/)")
+    parser.add_argument("--start-date", type=date.fromisoformat, metavar="YYYY-MM-DD",
+                        help="Day 1 を開く日。期日が近い日から、--ahead 日先までの欠けている日だけを生成する")
+    parser.add_argument("--ahead", type=int, default=DEFAULT_AHEAD,
+                        help=f"今日から何日先まで用意しておくか (デフォルト: {DEFAULT_AHEAD})")
+    parser.add_argument("--today", type=date.fromisoformat, metavar="YYYY-MM-DD",
+                        help="今日の日付を上書きする（--start-date の試し用）")
+    parser.add_argument("--prompt", choices=list(PROMPTS), default="full",
+                        help="system プロンプトの版 (compact は同じ仕様を略記した短い版、python bench.py prompt で比較)")
+    parser.add_argument("--report", action="store_true",
+                        help="metrics/generation.jsonl を集計して表示（レイテンシ・トークン・コスト）")
+    parser.add_argument("--validate", action="store_true",
+                        help="既存のJSONをスキーマで検証するだけ（APIは呼ばない）")
+    parser.add_argument("--repair", action="store_true",
+                        help="既存のJSONを検証し、壊れたセクションだけ再生成する")
+    parser.add_argument("--resume", action="store_true",
+                        help="JSONがあり、前回と同じプロンプトで成功済みの日はスキップ")
+    parser.add_argument("--force", action="store_true",
+                        help="レスポンスキャッシュを使わず必ずAPIを呼ぶ")
+    parser.add_argument("--output-dir", type=Path, default=OUTPUT_DIR,
+                        help="JSONの出力先 (デフォルト: content/)")
     args = parser.parse_args()
 
-    if not args.day and not args.all and not args.range:
+    if args.report:
+        print_report()
+        sys.exit(0)
+
+    if not args.day and not args.all and not args.range and not args.batch and not args.start_date:
         print("Usage: python generate_content.py --day 1    (1日分)")
         print("       python generate_content.py --range 1-5 (範囲)")
         print("       python generate_content.py --all       (全30日)")
+        print("       python generate_content.py --all --concurrency 8 (8並列)")
+        print("       python generate_content.py --all --batch  (Batches APIで一括)")
+        print("       python generate_content.py --all --validate (既存JSONの検証)")
+        print("       python generate_content.py --start-date 2026-11-01 --ahead 3 (期日順・cron向け)")
+        print("       python generate_content.py --report       (メトリクス集計)")
         sys.exit(0)
 
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if not api_key:
-        print("Error: ANTHROPIC_API_KEY 環境変数を設定してください。")
-        sys.exit(1)
-
-    client = anthropic.Anthropic(api_key=api_key)
-    output_dir = Path(__file__).parent / "content"
-    output_dir.mkdir(exist_ok=True)
-
     # Determine which days to generate
     if args.day:
         days = [args.day]
     elif args.range:
         start, end = map(int, args.range.split("-"))
         days = list(range(start, end + 1))
-    else:
+    elif args.all:
         days = list(range(1, 31))
-
-    print(f"Generating {len(days)} day(s) of content...")
+    else:
+        days = []  # --batch のみ: 前回のバッチを再開
 
     for day in days:
         if day < 1 or day > 30:
             print(f"  Skipping Day {day} (out of range)")
-            continue
-        try:
-            data = generate_day(client, day)
-            # Add emoji
-            data["emoji"] = EMOJI_MAP.get(MENU[day], "🍰")
-            out_path = output_dir / f"day{day}.json"
-            with open(out_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"  Saved: {out_path}")
-        except json.JSONDecodeError as e:
-            print(f"  ERROR (JSON parse): Day {day} - {e}")
-        except Exception as e:
-            print(f"  ERROR: Day {day} - {e}")
+    days = [day for day in days if 1 <= day <= 30]
+
+    output_dir = args.output_dir
+    opts = {"force": args.force, "split": args.split, "tool_use": args.tool_use, "record": args.record,
+            "route": load_routes(args.routes) if args.routes else ({} if args.route else None),
+            "hedge": Hedger(args.hedge, args.hedge_budget) if args.hedge else None,
+            "build": args.docs_dir if args.build else None, "prompt": args.prompt}
+
+    if args.start_date:
+        today = args.today or date.today()
+        current = (today - args.start_date).days + 1
+        days = plan_days(args.start_date, today, args.ahead, output_dir)
+        where = f"is Day {current}" if current >= 1 else f"is before Day 1 ({args.start_date})"
+        print(f"Schedule: {today} {where}, keeping up to Day {min(TOTAL_DAYS, current + args.ahead)} ready")
+        if not days:
+            print("  Nothing to do.")
+            sys.exit(0)
+        for day in days:
+            due = due_date(args.start_date, day)
+            print(f"  Day {day}: due {due}{' (overdue)' if due < today else ''}")
+    if args.validate or args.repair:
+        print(f"Validating {len(days)} day(s) in {output_dir}...")
+        broken = check_days(days, output_dir)
+        print(f"\n{len(broken)} day(s) with problems.")
+        if not args.repair or not broken:
+            sys.exit(1 if broken else 0)
+
+    try:
+        keys = parse_key_pool(os.environ.get("ANTHROPIC_API_KEYS") or os.environ.get("ANTHROPIC_API_KEY", ""),
+                              args.rpm, args.tpm)
+    except ValueError as e:
+        print(f"Error: ANTHROPIC_API_KEYS - {e}")
+        sys.exit(1)
+    if not keys:
+        print("Error: ANTHROPIC_API_KEY（複数なら ANTHROPIC_API_KEYS）環境変数を設定してください。")
+        sys.exit(1)
+
+    # ANTHROPIC_BASE_URL を設定するとローカルのスタブ (mock_api.py) に向けられる
+    # 再送は RequestScheduler が行うので SDK 側のリトライは切る
+    slots = [KeySlot(f"key{i}", anthropic.AsyncAnthropic(api_key=key, max_retries=0), rpm, tpm, budget)
+             for i, (key, rpm, tpm, budget) in enumerate(keys, 1)]
+    if len(slots) > 1:
+        print("Key pool: " + ", ".join(f"{slot.name}=…{key[-4:]} ({rpm:g} rpm / {tpm:g} tpm)"
+                                       for slot, (key, rpm, tpm, _) in zip(slots, keys)))
+    client = slots[0].client
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.repair:
+        scheduler = RequestScheduler(slots=slots)
+        asyncio.run(run_repair(scheduler, broken, output_dir, opts))
+        print("\nDone!")
+        return
+
+    if args.resume:
+        manifest = load_state(RUN_MANIFEST)
+        done = [day for day in days if is_up_to_date(manifest, output_dir, day, opts)]
+        if done:
+            print(f"  Resume: skipping {len(done)} up-to-date day(s)")
+        days = [day for day in days if day not in done]
+        # 範囲は指定されていて、全部済んでいるだけ（送信済みで未回収のバッチがあればそちらを再開する）
+        unfinished = args.batch and load_state(BATCH_MANIFEST).get("status") not in (None, "done")
+        if not days and not unfinished:
+            print("  Nothing to do.")
+            sys.exit(0)
+
+    removed = prune_cache()
+    if removed:
+        print(f"  Pruned {removed} cache entr{'y' if removed == 1 else 'ies'}")
+
+    if args.batch:
+        if not days and load_state(BATCH_MANIFEST).get("status") in (None, "done"):
+            print("Error: 再開できるバッチがありません。--all / --range / --day を指定してください。")
+            sys.exit(1)
+        # バッチはキー（ワークスペース）ごとのものなので、再開できるよう常に先頭のキーで送る
+        batch_client = client.with_options(max_retries=RETRY_MAX)
+        asyncio.run(run_batch(batch_client, days, output_dir, opts))
+    else:
+        concurrency = max(1, args.concurrency)
+        print(f"Generating {len(days)} day(s) of content (concurrency={concurrency})...")
+        scheduler = RequestScheduler(slots=slots)
+        asyncio.run(run_days(scheduler, days, output_dir, concurrency, opts))
 
     print("\nDone!")
 
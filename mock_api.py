@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+mock_api.py
+generate_content.py の動作確認用ローカルスタブ（Messages API 互換の最小実装）。
+content/dayN.json をそのままレスポンスとして返すので、APIクレジットを使わずに試せる。
+ストリーミング(SSE)と Message Batches API（作成・取得・結果JSONL）、tool_choice 指定の
+ツール呼び出し（tool_use / input_json_delta）、count_tokens にも対応。
+APIキーごとのレート制限（--rpm を超えたら 429 + Retry-After）、401 を返すキー、529 overloaded の注入もできる。
+Usage: python mock_api.py [--port 8787] [--latency 0.5] [--batch-latency 20] [--bad-rate 0.2]
+                          [--rpm 20] [--overload-rate 0.1] [--output-cap 1200]
+                          [--stall-rate 0.1 --stall 5] [--latency-dist lognormal --latency-shape 0.8]
+                          [--tokens-per-sec 80] [--error-rate 0.05] [--content-dir DIR]
+                          [--key-rpm key-a=10] [--invalid-keys key-c]
+       ANTHROPIC_BASE_URL=http://127.0.0.1:8787 ANTHROPIC_API_KEY=dummy \
+         python generate_content.py --all --concurrency 8 --output-dir /tmp/out
+"""
+
+import json
+import re
+import sys
+import time
+import random
+import math
+import argparse
+import threading
+import itertools
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BASE_DIR = Path(__file__).parent
+CONTENT_DIR = BASE_DIR / "content"
+
+_ids = itertools.count(1)
+_batches = {}
+_batches_lock = threading.Lock()
+_cached_prefixes = set()
+_request_times = {}  # APIキー → 直近60秒のリクエスト時刻
+_rate_lock = threading.Lock()
+
+
+def check_rate_limit(key: str, rpm: int):
+    """キーごとに直近60秒のリクエスト数で判定する。(許可するか, ヘッダ) を返す。"""
+    now = time.time()
+    with _rate_lock:
+        times = _request_times.setdefault(key, deque())
+        while times and times[0] <= now - 60:
+            times.popleft()
+        allowed = not rpm or len(times) < rpm
+        if allowed:
+            times.append(now)
+        headers = {}
+        if rpm:
+            reset = times[0] + 60 if times else now
+            headers = {
+                "anthropic-ratelimit-requests-limit": str(rpm),
+                "anthropic-ratelimit-requests-remaining": str(max(0, rpm - len(times))),
+                "anthropic-ratelimit-requests-reset": iso(reset),
+            }
+            if not allowed:
+                headers["retry-after"] = str(max(1, math.ceil(reset - now)))
+    return allowed, headers
+
+
+def sample_latency(median: float, dist: str = "fixed", shape: float = 0.5) -> float:
+    """median を中央値とする分布から遅延秒数を1つ引く。
+
+    fixed: 常に median / uniform: 0〜2×median / lognormal: σ=shape /
+    pareto: α=shape の裾の重い分布（たまにとても遅い）。
+    """
+    if median <= 0 or dist == "fixed":
+        return max(0.0, median)
+    if dist == "uniform":
+        return random.uniform(0, 2 * median)
+    if dist == "lognormal":
+        return median * math.exp(shape * random.gauss(0, 1))
+    if dist == "pareto":
+        return median * random.paretovariate(shape) / 2 ** (1 / shape)
+    raise ValueError(f"unknown latency distribution: {dist}")
+
+
+def load_day_text(day: int, bad_rate: float = 0.0, keys: list = None, indent: int = 2) -> str:
+    """Day N の記録済みJSONをレスポンス本文として読み込む。
+
+    bad_rate の確率で「仕様外」の出力にする（選択肢が2つ / correct_index が範囲外）。
+    keys を指定するとそのセクションだけを返す（セクション単位の作り直し用）。
+    indent=None なら1行に詰める（ツール呼び出しの引数と同じ形）。
+    """
+    path = CONTENT_DIR / f"day{day}.json"
+    if not path.exists():
+        path = CONTENT_DIR / "day1.json"
+    data = json.loads(path.read_text(encoding="utf-8"))
+    data.pop("emoji", None)
+    data["day"] = day
+    if random.random() < bad_rate:
+        quiz = random.choice(["quiz1", "quiz2", "quiz3"])
+        if random.random() < 0.5:
+            data[quiz]["options"] = data[quiz]["options"][:2]
+        else:
+            data[quiz]["correct_index"] = 7
+    if keys:
+        data = {key: data[key] for key in keys if key in data}
+    return json.dumps(data, ensure_ascii=False, indent=indent)
+
+
+def prompt_text(body: dict, roles: tuple = ("user", "assistant")) -> str:
+    """リクエストの system + messages をひとつの文字列にまとめる。"""
+    parts = []
+    system = body.get("system") or []
+    if isinstance(system, str):
+        system = [{"text": system}]
+    parts += [block.get("text", "") for block in system]
+    for message in body.get("messages", []):
+        if message.get("role") not in roles:
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts += [block.get("text", "") for block in content or []]
+    return "\n".join(parts)
+
+
+def find_day(body: dict) -> int:
+    """プロンプト中の 'Day N' から日番号を取り出す。"""
+    matches = re.findall(r"Day (\d+)", prompt_text(body, roles=("user",)))
+    return int(matches[-1]) if matches else 1
+
+
+def cache_usage(body: dict) -> dict:
+    """cache_control 付き system ブロックの prompt caching を模した usage。"""
+    system = body.get("system")
+    if not isinstance(system, list) or not any("cache_control" in block for block in system):
+        return {"input_tokens": len(prompt_text(body)) // 2}
+    prefix = "".join(block.get("text", "") for block in system)
+    prefix_tokens = len(prefix) // 2
+    usage = {"input_tokens": len(prompt_text(body)) // 2 - prefix_tokens}
+    if prefix in _cached_prefixes:
+        usage["cache_read_input_tokens"] = prefix_tokens
+    else:
+        _cached_prefixes.add(prefix)
+        usage["cache_creation_input_tokens"] = prefix_tokens
+    return usage
+
+
+def tool_of(body: dict):
+    """tool_choice で指定されたツール（なければ None）。"""
+    choice = body.get("tool_choice") or {}
+    for tool in body.get("tools") or []:
+        if tool.get("name") == choice.get("name"):
+            return tool
+    return None
+
+
+def find_keys(body: dict):
+    """「"a", "b" のキーだけを」という指示があれば、そのキーのリストを返す。
+
+    ツール呼び出しなら入力スキーマのプロパティを使う。
+    """
+    tool = tool_of(body)
+    if tool:
+        return list(tool["input_schema"].get("properties", {}))
+    match = re.search(r'((?:"\w+"(?:, )?)+) のキーだけ', prompt_text(body, roles=("user",)))
+    return re.findall(r'"(\w+)"', match.group(1)) if match else None
+
+
+def prefill_text(body: dict) -> str:
+    """最後のメッセージが assistant なら、その内容（続きを生成する起点）を返す。"""
+    messages = body.get("messages", [])
+    if not messages or messages[-1].get("role") != "assistant":
+        return ""
+    content = messages[-1]["content"]
+    return content if isinstance(content, str) else "".join(b.get("text", "") for b in content)
+
+
+def reply_text(body: dict, bad_rate: float = 0.0, output_cap: int = 0) -> tuple:
+    """リクエストへの応答本文と stop_reason を返す。
+
+    assistant の先頭埋めがあればその続きだけを返す。出力が max_tokens（と output_cap）を
+    超える分は切り捨てて stop_reason を max_tokens にする。
+    """
+    prefill = prefill_text(body)
+    indent = None if tool_of(body) else 2
+    text = load_day_text(find_day(body), 0.0 if prefill else bad_rate, find_keys(body), indent)
+    if prefill and text.startswith(prefill):
+        text = text[len(prefill):]
+    limit = body.get("max_tokens") or 0
+    if output_cap:
+        limit = min(limit, output_cap) if limit else output_cap
+    if limit and len(text) // 3 > limit:
+        return text[:limit * 3], "max_tokens"
+    return text, "tool_use" if tool_of(body) else "end_turn"
+
+
+def make_message(body: dict, text: str, stop_reason: str = "end_turn") -> dict:
+    """Messages API 形式のレスポンスを組み立てる。ツール指定があれば text を引数にした tool_use にする。"""
+    tool = tool_of(body)
+    if tool:
+        try:
+            arguments = json.loads(text)
+        except json.JSONDecodeError:
+            arguments = {}  # max_tokens で切れた引数
+        content = [{"type": "tool_use", "id": f"toolu_mock_{next(_ids):06d}",
+                    "name": tool["name"], "input": arguments}]
+    else:
+        content = [{"type": "text", "text": text}]
+    return {
+        "id": f"msg_mock_{next(_ids):06d}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "mock"),
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {**cache_usage(body), "output_tokens": len(text) // 3},
+    }
+
+
+def iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def create_batch(requests: list, batch_latency: float) -> dict:
+    """バッチを登録する。batch_latency 秒後に ended になる。"""
+    batch_id = f"msgbatch_mock_{next(_ids):06d}"
+    with _batches_lock:
+        _batches[batch_id] = {
+            "created": time.time(),
+            "ends": time.time() + batch_latency,
+            "requests": requests,
+        }
+    return batch_object(batch_id)
+
+
+def batch_object(batch_id: str) -> dict:
+    """MessageBatch オブジェクトを返す。"""
+    batch = _batches[batch_id]
+    ended = time.time() >= batch["ends"]
+    total = len(batch["requests"])
+    return {
+        "id": batch_id,
+        "type": "message_batch",
+        "processing_status": "ended" if ended else "in_progress",
+        "request_counts": {
+            "processing": 0 if ended else total,
+            "succeeded": total if ended else 0,
+            "errored": 0, "canceled": 0, "expired": 0,
+        },
+        "created_at": iso(batch["created"]),
+        "expires_at": iso(batch["created"] + 86400),
+        "ended_at": iso(batch["ends"]) if ended else None,
+        "archived_at": None,
+        "cancel_initiated_at": None,
+        "results_url": f"/v1/messages/batches/{batch_id}/results" if ended else None,
+    }
+
+
+def batch_results(batch_id: str, output_cap: int = 0) -> bytes:
+    """結果を .jsonl で返す（実APIと同じく順不同）。"""
+    lines = []
+    for request in reversed(_batches[batch_id]["requests"]):
+        params = request["params"]
+        text, stop_reason = reply_text(params, output_cap=output_cap)
+        lines.append(json.dumps({
+            "custom_id": request["custom_id"],
+            "result": {"type": "succeeded", "message": make_message(params, text, stop_reason)},
+        }, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def sse_events(message: dict, text: str, chunk_chars: int = 40):
+    """メッセージを Messages API のストリーミングイベント列に分解する。
+
+    tool_use ブロックなら text（引数のJSON）を input_json_delta で少しずつ送る。
+    """
+    block = message["content"][0]
+    usage = message["usage"]
+    yield "message_start", {
+        "type": "message_start",
+        "message": {**message, "content": [], "stop_reason": None,
+                    "usage": {**usage, "output_tokens": 1}},
+    }
+    if block["type"] == "tool_use":
+        start_block = {**block, "input": {}}
+        delta = lambda piece: {"type": "input_json_delta", "partial_json": piece}
+    else:
+        start_block = {"type": "text", "text": ""}
+        delta = lambda piece: {"type": "text_delta", "text": piece}
+    yield "content_block_start", {"type": "content_block_start", "index": 0,
+                                  "content_block": start_block}
+    for start in range(0, len(text), chunk_chars):
+        yield "content_block_delta", {"type": "content_block_delta", "index": 0,
+                                      "delta": delta(text[start:start + chunk_chars])}
+    yield "content_block_stop", {"type": "content_block_stop", "index": 0}
+    yield "message_delta", {"type": "message_delta",
+                            "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                            "usage": {"output_tokens": usage["output_tokens"]}}
+    yield "message_stop", {"type": "message_stop"}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "mock-anthropic/0.1"
+    latency = 0.0
+    batch_latency = 10.0
+    bad_rate = 0.0
+    rpm = 0
+    overload_rate = 0.0
+    output_cap = 0
+    stall_rate = 0.0
+    stall = 0.0
+    latency_dist = "fixed"
+    latency_shape = 0.5
+    error_rate = 0.0
+    tokens_per_sec = 0.0
+    key_rpm = {}
+    invalid_keys = set()
+
+    def log_message(self, fmt, *args):
+        sys.stderr.write(f"  [mock] {self.command} {self.path} → {args[1] if len(args) > 1 else ''}\n")
+
+    def send_json(self, status: int, payload: dict, headers: dict = None):
+        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_error_json(self, status: int, error_type: str, message: str, headers: dict = None):
+        self.send_json(status, {"type": "error", "error": {"type": error_type, "message": message}}, headers)
+
+    def send_stream(self, message: dict, text: str, headers: dict = None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        events = list(sse_events(message, text))
+        # stall_rate の確率で、ランダムな位置（最初のトークン前を含む）で stall 秒止まる
+        stall_at = random.randrange(1, len(events)) if random.random() < self.stall_rate else None
+        try:
+            for i, (event, data) in enumerate(events):
+                if i == stall_at:
+                    time.sleep(random.uniform(0.5, 1.0) * self.stall)
+                if self.tokens_per_sec and event == "content_block_delta":
+                    # mock のトークン数は 3文字 = 1トークンで数える
+                    piece = data["delta"].get("text", data["delta"].get("partial_json", ""))
+                    time.sleep(len(piece) / 3 / self.tokens_per_sec)
+                payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                self.wfile.write(payload.encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # クライアントが途中で切断した（早期中断）
+
+    def send_not_found(self, path: str):
+        self.send_error_json(404, "not_found_error", path)
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        body = self.read_body()
+        if path == "/v1/messages":
+            key = self.headers.get("x-api-key", "")
+            if key in self.invalid_keys:
+                self.send_error_json(401, "authentication_error", "invalid x-api-key")
+                return
+            allowed, headers = check_rate_limit(key, self.key_rpm.get(key, self.rpm))
+            if not allowed:
+                self.send_error_json(429, "rate_limit_error", "Number of requests has exceeded your rate limit.", headers)
+                return
+            if random.random() < self.overload_rate:
+                self.send_error_json(529, "overloaded_error", "Overloaded")
+                return
+            if random.random() < self.error_rate:
+                self.send_error_json(500, "api_error", "Internal server error")
+                return
+            time.sleep(sample_latency(self.latency, self.latency_dist, self.latency_shape))
+            text, stop_reason = reply_text(body, self.bad_rate, self.output_cap)
+            message = make_message(body, text, stop_reason)
+            if body.get("stream"):
+                self.send_stream(message, text, headers)
+            else:
+                if self.tokens_per_sec:
+                    time.sleep(message["usage"]["output_tokens"] / self.tokens_per_sec)
+                self.send_json(200, message, headers)
+        elif path == "/v1/messages/count_tokens":
+            self.send_json(200, {"input_tokens": len(prompt_text(body)) // 2})
+        elif path == "/v1/messages/batches":
+            self.send_json(200, create_batch(body["requests"], self.batch_latency))
+        else:
+            self.send_not_found(path)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        match = re.fullmatch(r"/v1/messages/batches/([\w-]+)(/results)?", path)
+        if not match or match.group(1) not in _batches:
+            self.send_not_found(path)
+            return
+        batch_id, results = match.groups()
+        if not results:
+            self.send_json(200, batch_object(batch_id))
+            return
+        raw = batch_results(batch_id, self.output_cap)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/binary")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+
+def main():
+    global CONTENT_DIR
+    parser = argparse.ArgumentParser(description="Messages API のローカルスタブ")
+    parser.add_argument("--port", type=int, default=8787, help="待ち受けポート (デフォルト: 8787)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="最初のトークンまでの遅延秒数（--latency-dist の中央値）")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal", "pareto"], default="fixed",
+                        help="遅延の分布 (デフォルト: fixed)")
+    parser.add_argument("--latency-shape", type=float, default=0.5,
+                        help="lognormal の σ / pareto の α (デフォルト: 0.5)")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0,
+                        help="出力トークンのストリーミング速度 (0 = 待たずに一気に送る)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="500 api_error を返す確率")
+    parser.add_argument("--content-dir", type=Path, default=CONTENT_DIR,
+                        help="応答として再生する dayN.json のディレクトリ (デフォルト: content/)")
+    parser.add_argument("--batch-latency", type=float, default=10.0,
+                        help="バッチが ended になるまでの秒数")
+    parser.add_argument("--bad-rate", type=float, default=0.0,
+                        help="仕様外のJSON（選択肢2つ / correct_index 範囲外）を返す確率")
+    parser.add_argument("--rpm", type=int, default=0,
+                        help="APIキーごとの1分あたりのリクエスト上限。超えると 429 (0 = 無制限)")
+    parser.add_argument("--key-rpm", action="append", default=[], metavar="KEY=RPM",
+                        help="特定のキーだけ上限を変える（複数指定可）")
+    parser.add_argument("--invalid-keys", default="", metavar="KEY,...",
+                        help="401 authentication_error を返すキー")
+    parser.add_argument("--overload-rate", type=float, default=0.0,
+                        help="529 overloaded を返す確率")
+    parser.add_argument("--output-cap", type=int, default=0,
+                        help="出力トークンの上限。超えると max_tokens で打ち切る (0 = max_tokens のみ)")
+    parser.add_argument("--stall-rate", type=float, default=0.0,
+                        help="ストリームの途中（最初のトークン前を含む）で止まる確率")
+    parser.add_argument("--stall", type=float, default=5.0,
+                        help="止まる秒数の上限 (上限の 0.5〜1 倍でランダム、デフォルト: 5)")
+    args = parser.parse_args()
+
+    CONTENT_DIR = args.content_dir
+    MockHandler.latency_dist = args.latency_dist
+    MockHandler.latency_shape = args.latency_shape
+    MockHandler.tokens_per_sec = args.tokens_per_sec
+    MockHandler.error_rate = args.error_rate
+    MockHandler.key_rpm = {key: int(rpm) for key, rpm in (item.split("=", 1) for item in args.key_rpm)}
+    MockHandler.invalid_keys = {key for key in args.invalid_keys.split(",") if key}
+    MockHandler.stall_rate = args.stall_rate
+    MockHandler.stall = args.stall
+    MockHandler.output_cap = args.output_cap
+    MockHandler.rpm = args.rpm
+    MockHandler.overload_rate = args.overload_rate
+    MockHandler.latency = args.latency
+    MockHandler.bad_rate = args.bad_rate
+    MockHandler.batch_latency = args.batch_latency
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), MockHandler)
+    print(f"Mock API listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()